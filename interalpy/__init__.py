@@ -1,3 +1,6 @@
+from interalpy.estimate.multistart import multistart
 from interalpy.estimate.estimate import estimate
+from interalpy.simulate.simulate import simulate_population
+from interalpy.simulate.simulate import simulate_model
 from interalpy.simulate.simulate import simulate
 from interalpy.clsModel import ModelCls
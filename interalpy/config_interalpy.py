@@ -15,13 +15,66 @@ DATA_DTYPES = dict()
 DATA_DTYPES.update({'Participant.code': str, 'Question': np.int, 'x': np.float,  'y': np.float})
 DATA_DTYPES.update({'I1': np.float, 'I2': np.float, 'm': np.float, 'D': np.int})
 
-# We want to be strict about any problems due to floating-point errors.
-np.seterr(all='raise')
+# The grid of choices is stored as a collection of columns.
+GRID_LABELS = ['Question', 'm', 'x', 'y', 'I1', 'I2']
+GRID_DTYPES = {'Question': np.int64, 'm': np.float64, 'x': np.float64, 'y': np.float64}
+GRID_DTYPES.update({'I1': np.float64, 'I2': np.float64})
+
+# The simulated datasets are also stored as structured arrays with the following columns.
+SIM_LABELS = ['Participant.code', 'Question', 'm', 'D', 'eu_a', 'eu_b', 'prob_a', 'prob_b']
+SIM_DTYPES = {'Participant.code': np.int64, 'Question': np.int64, 'm': np.float64, 'D': np.int64}
+SIM_DTYPES.update({'eu_a': np.float64, 'eu_b': np.float64, 'prob_a': np.float64})
+SIM_DTYPES.update({'prob_b': np.float64})
+
+# The parallel simulation draws the choices for blocks of agents from independent random streams.
+# The simulated sample only depends on the block size and not on the number of processes.
+SIM_BLOCK_SIZE = 1000
+
+# The estimation writes a checkpoint after this number of evaluations or seconds, whichever comes
+# first, and once more at its termination.
+CHECKPOINT_FREQ = 10
+CHECKPOINT_TIME = 60.0
+
+# We need to keep track of these attributes of the estimation to resume it.
+CHECKPOINT_LABELS = ['num_step', 'num_eval', 'x_econ_all_start', 'x_econ_all_step']
+CHECKPOINT_LABELS += ['x_econ_all_current', 'f_start', 'f_step', 'f_current']
+
+# The logging of the estimation is kept in memory and only written to disk after a number of
+# evaluations or seconds, whichever comes first. The log is compressed and restarted once it
+# exceeds a maximum number of bytes, which is disabled by default. All settings can also be set
+# with the INTERALPY_LOG_FLUSH_EVALS, INTERALPY_LOG_FLUSH_TIME, and INTERALPY_LOG_MAX_BYTES
+# environment variables, which are only read once the package is imported. The values in this
+# module are looked up at the start of each estimation.
+LOG_FLUSH_EVALS = int(os.environ.get('INTERALPY_LOG_FLUSH_EVALS', 10))
+LOG_FLUSH_TIME = float(os.environ.get('INTERALPY_LOG_FLUSH_TIME', 5.0))
+LOG_MAX_BYTES = os.environ.get('INTERALPY_LOG_MAX_BYTES', None)
+if LOG_MAX_BYTES is not None:
+    LOG_MAX_BYTES = int(LOG_MAX_BYTES)
+
+# We keep the solutions of the grid for the most recently evaluated parameter values.
+CACHE_SIZE = 128
+
+# We provide a compiled backend for the evaluation of the criterion function for batches of
+# parameter vectors. It is selected by setting the INTERALPY_BACKEND environment variable to
+# NUMBA and we fall back to the NumPy engine whenever numba is not available. We only import numba
+# once the compiled backend is actually used.
+BACKEND = os.environ.get('INTERALPY_BACKEND', 'NUMPY').upper()
 
 # We ensure extensibility for future increases in the parameter count.
 PARA_LABELS = ['r', 'eta', 'b', 'nu']
 NUM_PARAS = len(PARA_LABELS)
 
+# We count the warnings recorded by the logger for each evaluation, see LoggerCls for the codes.
+NUM_WARNINGS = 3
+
+# The history of the estimation is stored as a structured array with one row for each evaluation,
+# where the time is the wall-clock time in seconds since the epoch. Rows that are not used yet
+# have an evaluation index of zero.
+HISTORY_DTYPE = [('num_eval', np.int64), ('f_current', np.float64)]
+HISTORY_DTYPE += [('x_econ_all', np.float64, (NUM_PARAS,))]
+HISTORY_DTYPE += [('x_optim_all', np.float64, (NUM_PARAS,))]
+HISTORY_DTYPE += [('time', np.float64), ('warnings', np.int64, (NUM_WARNINGS,))]
+
 # We need to impose some bounds on selected estimation parameters. The bounds are included in the
 # package's admissible values.
 DEFAULT_BOUNDS = dict()
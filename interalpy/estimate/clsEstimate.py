@@ -1,8 +1,26 @@
 """This module contains the class to manage the model estimation."""
-from interalpy.shared.shared_auxiliary import criterion_function
+import numpy as np
+import time
+import io
+
+from interalpy.shared.shared_auxiliary import criterion_gradient_counts
+from interalpy.shared.shared_auxiliary import criterion_function_counts
+from interalpy.shared.shared_auxiliary import criterion_function_batch
+from interalpy.shared.shared_auxiliary import criterion_gradient_batch
+from interalpy.shared.shared_auxiliary import record_events
+from interalpy.shared.shared_auxiliary import get_events
+from interalpy.estimate.estimate_auxiliary import get_standard_errors
+from interalpy.estimate.estimate_auxiliary import write_checkpoint
 from interalpy.estimate.estimate_auxiliary import char_floats
 from interalpy.custom_exceptions import MaxfunError
+from interalpy.logging.clsLogBuffer import LogBufferCls
+from interalpy.logging.clsHistory import HistoryCls
 from interalpy.logging.clsLogger import logger_obj
+from interalpy.shared.clsCache import cache_eu_obj
+from interalpy.shared.clsCache import cache_obj
+from interalpy.config_interalpy import CHECKPOINT_LABELS
+from interalpy.config_interalpy import CHECKPOINT_FREQ
+from interalpy.config_interalpy import CHECKPOINT_TIME
 from interalpy.config_interalpy import PARA_LABELS
 from interalpy.config_interalpy import HUGE_FLOAT
 from interalpy.config_interalpy import NUM_PARAS
@@ -11,11 +29,12 @@ from interalpy.shared.clsBase import BaseCls
 
 class EstimateClass(BaseCls):
     """This class manages all issues about the model estimation."""
-    def __init__(self, df, paras_obj, max_eval):
+    def __init__(self, df, df_counts, paras_obj, max_eval, checkpoint=None):
 
         self.attr = dict()
 
         # Initialization attributes
+        self.attr['df_counts'] = df_counts
         self.attr['paras_obj'] = paras_obj
         self.attr['max_eval'] = max_eval
         self.attr['df'] = df
@@ -32,24 +51,200 @@ class EstimateClass(BaseCls):
         self.attr['f_start'] = HUGE_FLOAT
         self.attr['f_step'] = HUGE_FLOAT
 
-        self._logging_start()
+        self.attr['last_checkpoint'] = time.time()
+
+        self.attr['log_obj'] = LogBufferCls('est.interalpy.log')
+
+        is_resume = checkpoint is not None
+        self.attr['history_obj'] = HistoryCls('est.interalpy.npy', max_eval, is_resume)
+
+        # We continue the bookkeeping of an earlier estimation run if requested.
+        if checkpoint is None:
+            self._logging_start()
+        else:
+            for key in CHECKPOINT_LABELS:
+                self.attr[key] = checkpoint[key]
+            self.attr['history_obj'].truncate(self.attr['num_eval'])
+            self._logging_resume()
 
     def evaluate(self, x_optim_free_current):
         """This method allows to evaluate the criterion function during an estimation"""
         # Distribute class attributes
+        df_counts = self.attr['df_counts']
         paras_obj = self.attr['paras_obj']
-        df = self.attr['df']
 
         # Construct relevant set of parameters
         paras_obj.set_values('optim', 'free', x_optim_free_current)
         x_optim_all_current = paras_obj.get_values('optim', 'all')
         x_econ_all_current = paras_obj.get_values('econ', 'all')
-        fval = criterion_function(df, *x_econ_all_current)
+        fval = criterion_function_counts(df_counts, *x_econ_all_current)
 
         self._update_evaluation(fval, x_econ_all_current, x_optim_all_current)
 
         return fval
 
+    def gradient(self, x_optim_free_current):
+        """This method allows to evaluate the analytic gradient of the criterion function with
+        respect to the free parameters used by the optimizer."""
+        # Distribute class attributes
+        df_counts = self.attr['df_counts']
+        paras_obj = self.attr['paras_obj']
+
+        # The gradient is not an evaluation, so its events must not be charged to the next one.
+        errors = logger_obj.get_attr('errors').copy()
+
+        # Construct relevant set of parameters
+        paras_obj.set_values('optim', 'free', x_optim_free_current)
+        x_econ_all_current = paras_obj.get_values('econ', 'all')
+
+        is_free = [not paras_obj.get_para(label)[1] for label in PARA_LABELS]
+
+        # We need to account for the transformation of the free parameters to the bounded
+        # interval of the economic parameters.
+        grad_econ_all = criterion_gradient_counts(df_counts, *x_econ_all_current)
+        grad = grad_econ_all[is_free] * paras_obj.get_jacobian(x_optim_free_current)
+
+        logger_obj.set_attr('errors', errors)
+
+        return grad
+
+    def gradient_numerical(self, x_optim_free_current, eps):
+        """This method allows to approximate the gradient of the criterion function with
+        respect to the free parameters used by the optimizer by forward differences. We follow
+        the step semantics of the optimizer, but evaluate the criterion function at all points of
+        the stencil as a single batch. Each point still counts as a separate evaluation and is
+        logged just as any other evaluation."""
+        # Distribute class attributes
+        df_counts = self.attr['df_counts']
+        paras_obj = self.attr['paras_obj']
+
+        x_optim_free_current = np.array(x_optim_free_current, dtype=float)
+        num_free = x_optim_free_current.shape[0]
+
+        # The first point of the stencil is the current point itself.
+        stencil = np.tile(x_optim_free_current, (num_free + 1, 1))
+        stencil[1:, :] += np.identity(num_free) * eps
+
+        # We keep track of the events for each point of the stencil, so that they are recorded
+        # together with its evaluation.
+        errors = logger_obj.get_attr('errors').copy()
+
+        x_econ_all_stencil, x_optim_all_stencil, events_stencil = list(), list(), list()
+        for x_optim_free in stencil:
+            paras_obj.set_values('optim', 'free', x_optim_free)
+            x_optim_all_stencil += [paras_obj.get_values('optim', 'all')]
+            x_econ_all_stencil += [paras_obj.get_values('econ', 'all')]
+            events_stencil += [get_events(errors)]
+            logger_obj.set_attr('errors', errors.copy())
+
+        # We need to reset the parameter values as they are modified by the stencil.
+        paras_obj.set_values('optim', 'free', x_optim_free_current)
+        logger_obj.set_attr('errors', errors)
+
+        # The optimizer usually requests the gradient at the point of the most recent evaluation,
+        # so there is no need to evaluate the criterion function there again.
+        is_current = x_econ_all_stencil[0] == self.attr['x_econ_all_current']
+        start = 1 if is_current else 0
+
+        fvals = np.tile(self.attr['f_current'], num_free + 1)
+        fvals[start:], events_eval = criterion_function_batch(df_counts,
+            x_econ_all_stencil[start:], is_events=True)
+
+        for i in range(start, num_free + 1):
+            record_events(events_stencil[i])
+            record_events(events_eval[i - start])
+            self._update_evaluation(fvals[i], x_econ_all_stencil[i], x_optim_all_stencil[i])
+
+        grad = (fvals[1:] - fvals[0]) / eps
+
+        return grad
+
+    def hessian(self, x_optim_free_current, step=10e-6):
+        """This method approximates the Hessian of the criterion function with respect to the
+        free parameters used by the optimizer. We use central differences of the analytic
+        gradient and evaluate the gradient at all points of the stencil as a single batch."""
+        # Distribute class attributes
+        df_counts = self.attr['df_counts']
+        paras_obj = self.attr['paras_obj']
+
+        x_optim_free_current = np.array(x_optim_free_current, dtype=float)
+        num_free = x_optim_free_current.shape[0]
+
+        # The Hessian is not an evaluation, so we do not record any of its events.
+        errors = logger_obj.get_attr('errors').copy()
+
+        # The stencil first contains all upper and then all lower points.
+        stencil = np.tile(x_optim_free_current, (2 * num_free, 1))
+        stencil[:num_free, :] += np.identity(num_free) * step
+        stencil[num_free:, :] -= np.identity(num_free) * step
+
+        x_econ_all_stencil, jacobians = list(), list()
+        for x_optim_free in stencil:
+            paras_obj.set_values('optim', 'free', x_optim_free)
+            x_econ_all_stencil += [paras_obj.get_values('econ', 'all')]
+            jacobians += [paras_obj.get_jacobian(x_optim_free)]
+
+        # We need to reset the parameter values as they are modified by the stencil.
+        paras_obj.set_values('optim', 'free', x_optim_free_current)
+
+        is_free = [not paras_obj.get_para(label)[1] for label in PARA_LABELS]
+
+        # We need to account for the transformation of the free parameters to the bounded
+        # interval of the economic parameters.
+        grads = criterion_gradient_batch(df_counts, x_econ_all_stencil)[:, is_free] * jacobians
+
+        hess = (grads[:num_free, :] - grads[num_free:, :]) / (2 * step)
+
+        logger_obj.set_attr('errors', errors)
+
+        return (hess + hess.T) / 2
+
+    def inference(self, x_optim_free_current):
+        """This method computes the standard errors of all parameters at the requested point and
+        records them in the information file."""
+        # Distribute class attributes
+        df_counts = self.attr['df_counts']
+        paras_obj = self.attr['paras_obj']
+
+        hess = self.hessian(x_optim_free_current)
+        num_obs = df_counts[['n_A', 'n_B']].values.sum()
+
+        # The inference is not an evaluation, so we do not record any of its events.
+        errors = logger_obj.get_attr('errors').copy()
+        paras_obj.set_values('optim', 'free', x_optim_free_current)
+        logger_obj.set_attr('errors', errors)
+
+        is_free = [not paras_obj.get_para(label)[1] for label in PARA_LABELS]
+        jacobian = paras_obj.get_jacobian(x_optim_free_current)
+
+        se_optim_free, se_econ_free = get_standard_errors(hess, num_obs, jacobian)
+
+        # The standard errors are not available for the fixed parameters.
+        se_optim_all, se_econ_all = np.tile(np.inf, NUM_PARAS), np.tile(np.inf, NUM_PARAS)
+        se_optim_all[is_free], se_econ_all[is_free] = se_optim_free, se_econ_free
+
+        self._logging_inference(se_econ_all, se_optim_all)
+
+        return se_econ_all, se_optim_all
+
+    def flush(self):
+        """This method writes all buffered log entries to disk and updates the information file.
+        It needs to be called at the termination of the estimation."""
+        self.attr['history_obj'].flush()
+        self.attr['log_obj'].flush()
+        self._logging_info()
+
+    def write_checkpoint(self):
+        """This method writes all information to file that is required to resume the estimation
+        run."""
+        checkpoint = dict()
+        for key in CHECKPOINT_LABELS:
+            checkpoint[key] = self.attr[key]
+
+        write_checkpoint(checkpoint)
+
+        self.attr['last_checkpoint'] = time.time()
+
     def _update_evaluation(self, fval, x_econ_all_current, x_optim_all_current):
         """This method updates all attributes based on the new evaluation and writes some
         information to files."""
@@ -74,7 +269,17 @@ class EstimateClass(BaseCls):
             self.attr['f_step'] = fval
             self.attr['num_step'] += 1
 
-        self._logging_evaluation(is_stop, x_econ_all_current, x_optim_all_current)
+        self.attr['history_obj'].append(self.attr['num_eval'], fval, x_econ_all_current,
+            x_optim_all_current, logger_obj.get_attr('errors'))
+
+        # We write the checkpoint every CHECKPOINT_FREQ evaluations or CHECKPOINT_TIME seconds,
+        # whichever comes first.
+        is_due = self.attr['num_eval'] % CHECKPOINT_FREQ == 0
+        is_due = is_due or (time.time() - self.attr['last_checkpoint']) >= CHECKPOINT_TIME
+        if is_due:
+            self.write_checkpoint()
+
+        self._logging_evaluation(is_step, is_stop, x_econ_all_current, x_optim_all_current)
 
     def _logging_start(self):
         """This method records some basic properties of the estimation at the beginning."""
@@ -102,9 +307,56 @@ class EstimateClass(BaseCls):
                 line = [i] + char_floats(bounds)
                 outfile.write(fmt_.format(*line) + '\n')
 
-    def _logging_evaluation(self, is_stop, x_econ_all_current, x_optim_all_current):
-        """This methods manages all issues related to the logging of the estimation."""
-        # Update class attributes
+    def _logging_resume(self):
+        """This method records the resumption of an earlier estimation run."""
+        with open('est.interalpy.log', 'a') as outfile:
+            outfile.write('\n\n ESTIMATION RESUMED\n')
+
+            fmt_ = '\n Evaluations {:>9}\n'
+            outfile.write(fmt_.format(self.attr['num_eval']))
+
+    def _logging_evaluation(self, is_step, is_stop, x_econ_all_current, x_optim_all_current):
+        """This methods manages all issues related to the logging of the estimation. The log
+        entries are buffered in memory, while the information file is updated at each step and
+        whenever the buffer is flushed."""
+        # Distribute class attributes
+        log_obj = self.attr['log_obj']
+
+        outfile = io.StringIO()
+
+        outfile.write('\n\n')
+        fmt_ = '\n EVALUATION {:>10}  STEP {:>10}\n'
+        outfile.write(fmt_.format(*[self.attr['num_eval'], self.attr['num_step']]))
+
+        fmt_ = '\n Criterion {:>28}  \n\n\n'
+        outfile.write(fmt_.format(char_floats(self.attr['f_current'])[0]))
+
+        fmt_ = ' {:>10}   ' + '{:<10}   ' + '{:>25}    ' * 2
+        line = ['Identifier','Label', 'Economic', 'Optimizer']
+        outfile.write(fmt_.format(*line) + '\n\n')
+
+        for i, _ in enumerate(range(NUM_PARAS)):
+            line = [i]
+            line += [PARA_LABELS[i]]
+            line+= char_floats([x_econ_all_current[i], x_optim_all_current[i]])
+            outfile.write(fmt_.format(*line) + '\n')
+        # We need to keep track of captured warnings.
+        logger_obj.flush(outfile)
+
+        is_flush = log_obj.add_entry(outfile.getvalue()) or is_stop
+        if is_flush:
+            log_obj.flush()
+
+        if is_step or is_flush:
+            self._logging_info()
+
+        # We can determine the estimation if the number of requested function evaluations is
+        # reached.
+        if is_stop:
+            raise MaxfunError
+
+    def _logging_info(self):
+        """This method writes the current state of the estimation to the information file."""
         with open('est.interalpy.info', 'w') as outfile:
             fmt_ = '{:>10}    '+ '{:<10}    ' +'{:>25}    ' * 3
 
@@ -131,31 +383,22 @@ class EstimateClass(BaseCls):
             outfile.write(fmt_.format(*['Number of Evaluations', self.attr['num_eval']]))
             outfile.write(fmt_.format(*['Number of Steps', self.attr['num_step']]))
 
-        with open('est.interalpy.log', 'a') as outfile:
-
-            outfile.write('\n\n')
-            fmt_ = '\n EVALUATION {:>10}  STEP {:>10}\n'
-            outfile.write(fmt_.format(*[self.attr['num_eval'], self.attr['num_step']]))
-
-            fmt_ = '\n Criterion {:>28}  \n\n\n'
-            outfile.write(fmt_.format(char_floats(self.attr['f_current'])[0]))
+    @staticmethod
+    def _logging_inference(se_econ_all, se_optim_all):
+        """This method records the standard errors of the parameters."""
+        with open('est.interalpy.info', 'a') as outfile:
+            fmt_ = '{:>10}    ' + '{:<10}    ' + '{:>25}    ' * 2
 
-            fmt_ = ' {:>10}   ' + '{:<10}   ' + '{:>25}    ' * 2
-            line = ['Identifier','Label', 'Economic', 'Optimizer']
+            outfile.write('\n\n {:<25}\n\n'.format('Standard Errors'))
+            line = ['Identifier', 'Label', 'Economic', 'Optimizer']
             outfile.write(fmt_.format(*line) + '\n\n')
-
             for i, _ in enumerate(range(NUM_PARAS)):
                 line = [i]
                 line += [PARA_LABELS[i]]
-                line+= char_floats([x_econ_all_current[i], x_optim_all_current[i]])
+                line += char_floats([se_econ_all[i], se_optim_all[i]])
                 outfile.write(fmt_.format(*line) + '\n')
-            # We need to keep track of captured warnings.
-            logger_obj.flush(outfile)
 
-        # We can determine the estimation if the number of requested function evaluations is
-        # reached.
-        if is_stop:
-            raise MaxfunError
+            outfile.write('\n')
 
     @staticmethod
     def finish(opt):
@@ -169,4 +412,12 @@ class EstimateClass(BaseCls):
             outfile.write('\n Success    {:<25}'.format(str(opt['success'])))
             outfile.write('\n')
 
+            outfile.write('\n {:<25}\n'.format('CACHE'))
+            fmt_ = '\n {:<10} {:>10} {:>10}'
+            outfile.write(fmt_.format(*['', 'Hits', 'Misses']))
+            for label, obj in [('Solutions', cache_obj), ('Utilities', cache_eu_obj)]:
+                line = [label, obj.get_attr('hits'), obj.get_attr('misses')]
+                outfile.write(fmt_.format(*line))
+            outfile.write('\n')
+
 
@@ -1,4 +1,5 @@
 """This module contains the capability to estimate the model."""
+import functools
 import shutil
 import copy
 
@@ -7,6 +8,9 @@ from scipy.optimize import minimize
 from interalpy.estimate.estimate_auxiliary import estimate_simulate
 from interalpy.shared.shared_auxiliary import dist_class_attributes
 from interalpy.estimate.estimate_auxiliary import estimate_cleanup
+from interalpy.estimate.estimate_auxiliary import read_checkpoint
+from interalpy.estimate.estimate_auxiliary import construct_fit
+from interalpy.estimate.estimate_auxiliary import write_fit
 from interalpy.estimate.clsEstimate import EstimateClass
 from interalpy.custom_exceptions import InteralpyError
 from interalpy.custom_exceptions import MaxfunError
@@ -14,69 +18,108 @@ from interalpy.process.process import process
 from interalpy.clsModel import ModelCls
 
 
-def estimate(fname):
-    """This function allow to estimate the model."""
-    estimate_cleanup()
+def estimate(fname, is_write=False, gradient='analytic', resume=False):
+    """This function allow to estimate the model. In the detailed mode, the simulated samples at
+    the start and stop of the estimation are only written to disk if requested. The
+    gradient-based optimizers either rely on the analytic gradient or on its approximation by
+    forward differences.
 
+    An interrupted estimation can be resumed from the checkpoint in est.interalpy.chk. The
+    optimizer is restarted at the best point so far and all evaluations count towards the
+    maximum number of evaluations. The internal state of the optimizer is not available from
+    scipy, so only the evaluation at the restart point is repeated."""
     model_obj = ModelCls(fname)
 
+    return estimate_model(model_obj, is_write, gradient, resume)
+
+
+def estimate_model(model_obj, is_write=False, gradient='analytic', resume=False):
+    """This function estimates the model directly from an instance of the model specification."""
+    checkpoint = None
+    if resume:
+        checkpoint = read_checkpoint()
+    else:
+        estimate_cleanup()
+
     # Distribute class attributes for further processing.
     est_file, maxfun, optimizer, opt_options, paras_obj, sim_agents, est_agents, \
         est_detailed = dist_class_attributes(model_obj, 'est_file', 'maxfun', 'optimizer',
             'opt_options', 'paras_obj', 'sim_agents', 'est_agents', 'est_detailed')
 
-    df = process(est_file, est_agents)
+    df, df_counts = process(est_file, est_agents)
+
+    # We restart the optimizer at the best point of the earlier estimation run.
+    if resume:
+        paras_obj.set_values('econ', 'all', checkpoint['x_econ_all_step'])
 
     x_optim_free_start = paras_obj.get_values('optim', 'free')
 
     # We simulate a sample at the starting point.
-    if est_detailed:
-        estimate_simulate('start', x_optim_free_start, model_obj, df)
+    if est_detailed and not resume:
+        estimate_simulate('start', x_optim_free_start, model_obj, df, is_write)
 
     # We need to initialize the shared classes, which also starts the logfile and writes out some
     # initial information.
-    estimate_obj = EstimateClass(df, copy.deepcopy(paras_obj), maxfun)
+    estimate_obj = EstimateClass(df, df_counts, copy.deepcopy(paras_obj), maxfun, checkpoint)
 
     # Not all algorithms are using the starting values as the very first evaluation.
-    estimate_obj.evaluate(x_optim_free_start)
+    if not resume:
+        estimate_obj.evaluate(x_optim_free_start)
 
     # We are faced with a serious estimation request.
     opt = dict()
     opt['message'] = 'Optimization reached maximum number of function evaluations.'
     opt['success'] = False
 
-    if maxfun > 1:
+    if maxfun > 1 and estimate_obj.get_attr('num_eval') < maxfun:
 
         options = dict()
 
         if optimizer == 'SCIPY-BFGS':
             options['gtol'] = opt_options['SCIPY-BFGS']['gtol']
-            options['eps'] = opt_options['SCIPY-BFGS']['eps']
-            method = 'BFGS'
+            if gradient == 'analytic':
+                method, jac = 'BFGS', estimate_obj.gradient
+            elif gradient == 'numerical':
+                options['eps'] = opt_options['SCIPY-BFGS']['eps']
+                jac = functools.partial(estimate_obj.gradient_numerical, eps=options['eps'])
+                method = 'BFGS'
+            else:
+                raise InteralpyError('flawed choice of gradient')
         elif optimizer == 'SCIPY-POWELL':
             options['ftol'] = opt_options['SCIPY-POWELL']['ftol']
             options['xtol'] = opt_options['SCIPY-POWELL']['xtol']
-            method = 'POWELL'
+            method, jac = 'POWELL', None
         else:
             raise InteralpyError('flawed choice of optimization method')
 
         try:
-            opt = minimize(estimate_obj.evaluate, x_optim_free_start, method=method, options=options)
+            opt = minimize(estimate_obj.evaluate, x_optim_free_start, method=method, jac=jac,
+                options=options)
         except MaxfunError:
             pass
 
-    # Now we can wrap up all estimation related tasks.
-    estimate_obj.finish(opt)
+    estimate_obj.write_checkpoint()
+    estimate_obj.flush()
 
-    # We also simulate a sample at the stop of the estimation.
+    # We determine the best point in the perspective of the optimizer.
     x_econ_all_step = estimate_obj.get_attr('x_econ_all_step')
     paras_obj.set_values('econ', 'all', x_econ_all_step)
     x_optim_free_step = paras_obj.get_values('optim', 'free')
 
+    # We compute the standard errors at the best point and wrap up all estimation related tasks.
+    estimate_obj.inference(x_optim_free_step)
+    estimate_obj.finish(opt)
+
+    # We compare the observed choice shares with the choice probabilities implied by the model at
+    # the best point. The comparison with a simulated sample is only part of the detailed mode.
+    stats = construct_fit(df_counts, x_econ_all_step)
+    write_fit(stats, df['Participant.code'].nunique())
+
+    # We also simulate a sample at the stop of the estimation.
     if est_detailed:
         # We can compare a simulated sample using the estimation results with the observed
         # estimation dataset.
-        estimate_simulate('stop', x_optim_free_step, model_obj, df)
+        estimate_simulate('stop', x_optim_free_step, model_obj, df, is_write)
         shutil.copy('stop/compare.interalpy.info', '.')
 
     # We only return the best value of the criterion function and the corresponding parameter
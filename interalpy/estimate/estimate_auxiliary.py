@@ -1,6 +1,8 @@
 """This module contains auxiliary functions that are only relevant for the estimation process."""
 import shutil
 import copy
+import glob
+import json
 import os
 
 from statsmodels.tools import eval_measures
@@ -8,8 +10,12 @@ import pandas as pd
 import numpy as np
 
 from interalpy.shared.shared_auxiliary import dist_class_attributes
+from interalpy.shared.shared_auxiliary import solve_grid_arrays
+from interalpy.simulate.simulate import simulate_model
+from interalpy.custom_exceptions import InteralpyError
+from interalpy.config_interalpy import PARA_LABELS
+from interalpy.config_interalpy import TINY_FLOAT
 from interalpy.config_interalpy import HUGE_FLOAT
-from interalpy.simulate.simulate import simulate
 
 
 def estimate_cleanup():
@@ -20,47 +26,48 @@ def estimate_cleanup():
             shutil.rmtree(dirname)
 
     # We remove the information from earlier estimation runs.
-    for fname in ['est.interalpy.info', 'est.interalpy.log']:
+    fnames = ['est.interalpy.info', 'est.interalpy.log', 'est.interalpy.chk', 'est.interalpy.npy']
+    fnames += ['fit.interalpy.info']
+    for fname in fnames + glob.glob('est.interalpy.log.*.gz'):
         if os.path.exists(fname):
             os.remove(fname)
 
 
-def estimate_simulate(which, points, model_obj, df_obs):
+def estimate_simulate(which, points, model_obj, df_obs, is_write=False):
     """This function allows to easily simulate samples at the beginning and the end of the
-    estimation."""
+    estimation. The sample is simulated and compared to the observed dataset in memory. The
+    simulated sample is only written to disk if requested."""
     sim_agents = dist_class_attributes(model_obj, 'sim_agents')
 
-    os.mkdir(which)
-    os.chdir(which)
+    if not os.path.exists(which):
+        os.mkdir(which)
 
     sim_model = copy.deepcopy(model_obj)
     sim_model.attr['sim_file'] = which
 
     sim_model.update('optim', 'free', points)
-    sim_model.write_out(which + '.interalpy.ini')
-    simulate(which + '.interalpy.ini')
+    if is_write:
+        sim_model.write_out(os.path.join(which, which + '.interalpy.ini'))
 
-    compare_datasets(which, df_obs, sim_agents)
+    # The specification refers to the simulated sample in its own directory, while we simulate
+    # from the current directory.
+    sim_model.attr['sim_file'] = os.path.join(which, which)
+    df_sim = simulate_model(sim_model, is_write=is_write)
 
-    os.chdir('../')
+    compare_datasets(df_obs, df_sim, sim_agents, os.path.join(which, 'compare.interalpy.info'))
 
 
-def compare_datasets(which, df, sim_agents):
+def compare_datasets(df, df_sim, sim_agents, fname='compare.interalpy.info'):
     """This function compares the estimation dataset with a simulated dataset using the estimated
     parameter vector."""
-    df_stop = pd.read_pickle(which + '.interalpy.pkl')
+    # We compute the choice shares for all cells of the grid in the observed dataset with a single
+    # aggregation and align the simulated shares with them.
+    stats = pd.DataFrame()
+    stats['Data'] = construct_shares(df)
+    stats['Simulation'] = construct_shares(df_sim).reindex(stats.index)
+    stats['Difference'] = (stats['Data'] - stats['Simulation']).abs()
 
-    stats = []
-    for question in sorted(df['Question'].unique()):
-        for m in sorted(df['m'].loc[:, question, :].unique()):
-            stat = []
-            stat += [df['D'].loc[:, question, m].mean()]
-            stat += [df_stop['D'].loc[:, question, m].mean()]
-            stats += [stat]
-
-    stats = np.array(stats)
-
-    with open('compare.interalpy.info', 'w') as outfile:
+    with open(fname, 'w') as outfile:
         outfile.write('\n')
 
         fmt_ = '\n {:<25}{:>20}\n'
@@ -69,23 +76,175 @@ def compare_datasets(which, df, sim_agents):
         outfile.write(fmt_.format(*['Simulated Individuals', sim_agents]))
 
         fmt_ = '\n {:<25}{:>20.4f}\n'
-        stat = eval_measures.rmse(stats[:, 0], stats[:, 1])
+        stat = eval_measures.rmse(stats['Data'].values, stats['Simulation'].values)
         outfile.write(fmt_.format(*['Root-Mean-Square Error', stat]))
 
         string = '\n\n\n {:>15}{:>15}{:>15}{:>15}{:>15}\n'
         outfile.write(string.format(*['Question', 'm', 'Data', 'Simulation', 'Difference']))
 
-        stats = stats.tolist()
-
-        count = 0
-        for question in sorted(df['Question'].unique()):
+        for question, df_question in stats.groupby(level='Question', sort=False):
             outfile.write('\n')
-            for m in sorted(df['m'].loc[:, question, :].unique()):
-                stat = stats[count]
+            for (_, m), stat in zip(df_question.index.tolist(), df_question.values.tolist()):
                 string = ' {:>15d}{:>15}{:>15.4f}{:>15.4f}{:>15.4f}\n'
-                line = [question, m] + stat + [abs(stat[0] - stat[1])]
-                outfile.write(string.format(*line))
-                count += 1
+                outfile.write(string.format(*[question, m] + stat))
+
+
+def construct_fit(df_counts, x_econ_all):
+    """This function compares the observed choice shares with the choice probabilities implied by
+    the model. In contrast to the comparison with a simulated dataset, this diagnostic is exact
+    and only requires the solution of the grid. We also determine the contribution of each cell
+    of the grid to the criterion function, which add up to its value."""
+    solution = solve_grid_arrays(*x_econ_all)
+
+    n_a, n_b = df_counts['n_A'].values, df_counts['n_B'].values
+    num_obs = n_a.sum() + n_b.sum()
+
+    log_prob_a = np.clip(solution['log_prob_a'], np.log(TINY_FLOAT), np.inf)
+    log_prob_b = np.clip(solution['log_prob_b'], np.log(TINY_FLOAT), np.inf)
+
+    stats = pd.DataFrame()
+    stats['Question'], stats['m'] = df_counts['Question'].values, df_counts['m'].values
+    stats['Observations'] = n_a + n_b
+    stats['Data'] = n_a / np.maximum(n_a + n_b, 1)
+    stats['Model'] = solution['prob_a']
+    stats['Difference'] = (stats['Data'] - stats['Model']).abs()
+    stats['Contribution'] = -(log_prob_a * n_a + log_prob_b * n_b) / max(num_obs, 1)
+
+    # We only report on the cells of the grid that are part of the observed dataset.
+    stats = stats[stats['Observations'] > 0].sort_values(['Question', 'm'])
+
+    return stats
+
+
+def write_fit(stats, num_agents, fname='fit.interalpy.info'):
+    """This function writes the comparison of the observed choice shares with the choice
+    probabilities implied by the model to file."""
+    num_obs = stats['Observations'].sum()
+
+    with open(fname, 'w') as outfile:
+        outfile.write('\n')
+
+        fmt_ = '\n {:<25}{:>20}\n'
+        outfile.write(fmt_.format(*['Observed Individuals', num_agents]))
+        outfile.write(fmt_.format(*['Observed Choices', num_obs]))
+
+        fmt_ = '\n {:<25}{:>20.4f}\n'
+        stat = eval_measures.rmse(stats['Data'].values, stats['Model'].values)
+        outfile.write(fmt_.format(*['Root-Mean-Square Error', stat]))
+        outfile.write(fmt_.format(*['Criterion Function', stats['Contribution'].sum()]))
+
+        string = '\n\n\n {:>15}{:>15}{:>15}{:>15}{:>15}{:>15}\n'
+        labels = ['Question', 'm', 'Data', 'Model', 'Difference', 'Contribution']
+        outfile.write(string.format(*labels))
+
+        for question, df_question in stats.groupby(stats['Question'].values, sort=False):
+            outfile.write('\n')
+            for line in df_question[labels[1:]].values.tolist():
+                string = ' {:>15d}{:>15}{:>15.4f}{:>15.4f}{:>15.4f}{:>15.4f}\n'
+                outfile.write(string.format(*[question] + line))
+
+
+def construct_shares(df):
+    """This function computes the share of choices for lottery A in each cell of the grid. We
+    group on the values to avoid any ambiguity with the levels of the index."""
+    keys = [df['Question'].values, df['m'].values]
+
+    shares = df['D'].groupby(keys).mean()
+    shares.index.names = ['Question', 'm']
+
+    return shares
+
+
+def read_checkpoint(fname='est.interalpy.chk'):
+    """This function reads the checkpoint of an earlier estimation run."""
+    if not os.path.exists(fname):
+        raise InteralpyError('checkpoint does not exist')
+
+    with open(fname, 'r') as infile:
+        checkpoint = json.load(infile)
+
+    return checkpoint
+
+
+def read_history(fname='est.interalpy.npy'):
+    """This function reads the history of all evaluations of an estimation run. This is also
+    possible while the estimation is still running, as we only return the completed rows."""
+    records = np.load(fname, mmap_mode='r')
+
+    return np.array(records[records['num_eval'] > 0])
+
+
+def write_checkpoint(checkpoint, fname='est.interalpy.chk'):
+    """This function writes the checkpoint of an estimation run. We first write to a temporary
+    file and then replace the checkpoint, so that an interruption never leaves a partial file."""
+    with open(fname + '.tmp', 'w') as outfile:
+        json.dump(checkpoint, outfile, indent=4, sort_keys=True)
+
+    os.replace(fname + '.tmp', fname)
+
+
+def get_starts(paras_obj, num_starts, seed):
+    """This function returns starting points for the economic parameters from a Latin hypercube
+    inside the bounds of the free parameters. The fixed parameters remain at their values and the
+    first starting point is always the one from the initialization file."""
+    random_state = np.random.RandomState(seed)
+
+    starts = np.tile(paras_obj.get_values('econ', 'all'), (num_starts, 1))
+
+    num_draws = num_starts - 1
+    for i, label in enumerate(PARA_LABELS):
+        _, is_fixed, (lower, upper) = paras_obj.get_para(label)
+        if is_fixed or num_draws == 0:
+            continue
+
+        # We split each interval in equally sized strata and draw a single point from each of
+        # them. The strata are assigned to the starting points by a random permutation.
+        strata = random_state.permutation(num_draws)
+        stat = (strata + random_state.uniform(size=num_draws)) / num_draws
+        starts[1:, i] = lower + (upper - lower) * stat
+
+    return starts
+
+
+def write_multistart(df_optima, fname='multistart.interalpy.info'):
+    """This function writes the table of all local optima of the multistart estimation."""
+    with open(fname, 'w') as outfile:
+        outfile.write('\n')
+
+        fmt_ = '\n {:<25}{:>20}\n'
+        outfile.write(fmt_.format(*['Optimized Starts', df_optima.shape[0]]))
+
+        labels = ['Start', 'Screening', 'Criterion'] + PARA_LABELS
+        string = '\n\n\n' + ' {:>15}' * len(labels) + '\n\n'
+        outfile.write(string.format(*labels))
+
+        for line in df_optima[labels].values.tolist():
+            string = ' {:>15d}' + ' {:>15.5f}' * (len(labels) - 1) + '\n'
+            outfile.write(string.format(*[int(line[0])] + line[1:]))
+
+
+def get_standard_errors(hess, num_obs, jacobian):
+    """This function computes the standard errors of the free parameters from the Hessian of the
+    criterion function, which is the average negative log-likelihood. The standard errors for the
+    economic parameters are obtained by the delta method."""
+    num_free = hess.shape[0]
+
+    try:
+        cov_optim = np.linalg.inv(hess * num_obs)
+    except np.linalg.LinAlgError:
+        return np.tile(np.inf, num_free), np.tile(np.inf, num_free)
+
+    # The standard errors are only available if the Hessian is well behaved.
+    variances = np.diag(cov_optim)
+    is_valid = variances > 0
+
+    se_optim = np.tile(np.inf, num_free)
+    se_optim[is_valid] = np.sqrt(variances[is_valid])
+
+    se_econ = np.tile(np.inf, num_free)
+    se_econ[is_valid] = se_optim[is_valid] * np.abs(np.array(jacobian)[is_valid])
+
+    return se_optim, se_econ
 
 
 def char_floats(floats):
@@ -0,0 +1,103 @@
+"""This module contains the capability to estimate the model from multiple starting points."""
+import multiprocessing
+import shutil
+import copy
+import os
+
+import pandas as pd
+import numpy as np
+
+from interalpy.shared.shared_auxiliary import criterion_function_batch
+from interalpy.estimate.estimate_auxiliary import write_multistart
+from interalpy.shared.shared_auxiliary import dist_class_attributes
+from interalpy.estimate.estimate_auxiliary import get_starts
+from interalpy.estimate.estimate import estimate_model
+from interalpy.config_interalpy import PARA_LABELS
+from interalpy.process.process import process
+from interalpy.clsModel import ModelCls
+
+
+def multistart(fname, num_starts=100, num_best=5, num_procs=1, seed=None):
+    """This function estimates the model from multiple starting points. The starting points are
+    drawn from a Latin hypercube inside the bounds of the free parameters and screened by a single
+    batched evaluation of the criterion function. Only the most promising starting points are
+    optimized, each in a separate process and directory.
+
+    We return the best value of the criterion function and the corresponding parameter vector
+    just as a single estimation. In addition, we return a table of all local optima, which is also
+    written to multistart.interalpy.info."""
+    model_obj = ModelCls(fname)
+
+    # Distribute class attributes for further processing.
+    paras_obj, est_file, est_agents, sim_seed = dist_class_attributes(model_obj, 'paras_obj',
+        'est_file', 'est_agents', 'sim_seed')
+
+    if seed is None:
+        seed = sim_seed
+
+    _, df_counts = process(est_file, est_agents)
+
+    starts = get_starts(paras_obj, num_starts, seed)
+
+    # We evaluate the criterion function at all starting points at once and keep the best ones.
+    fvals = criterion_function_batch(df_counts, starts)
+    fvals = np.where(np.isfinite(fvals), fvals, np.inf)
+    idx_best = np.argsort(fvals, kind='mergesort')[:num_best]
+
+    # Each optimization runs in its own directory to keep the logging separate. The dataset needs
+    # to be available from all of them.
+    if os.path.exists('multistart'):
+        shutil.rmtree('multistart')
+
+    tasks = list()
+    for idx in idx_best:
+        start_model = copy.deepcopy(model_obj)
+        start_model.attr['est_file'] = os.path.abspath(est_file)
+        start_model.update('econ', 'all', starts[idx, :])
+
+        dirname = os.path.join('multistart', 'start_{:}'.format(idx))
+        os.makedirs(dirname)
+
+        tasks += [(os.path.abspath(dirname), start_model)]
+
+    if num_procs == 1:
+        rslts = [estimate_start(task) for task in tasks]
+    else:
+        with multiprocessing.Pool(num_procs) as pool:
+            rslts = pool.map(estimate_start, tasks)
+
+    df_optima = pd.DataFrame()
+    df_optima['Start'] = idx_best
+    df_optima['Screening'] = fvals[idx_best]
+    df_optima['Criterion'] = [rslt[0] for rslt in rslts]
+    for i, label in enumerate(PARA_LABELS):
+        df_optima[label] = [rslt[1][i] for rslt in rslts]
+
+    df_optima.sort_values(['Criterion', 'Start'], inplace=True)
+    df_optima.reset_index(drop=True, inplace=True)
+
+    write_multistart(df_optima)
+
+    rslt = list()
+    rslt.append(df_optima['Criterion'].iloc[0])
+    rslt.append(df_optima[PARA_LABELS].iloc[0].tolist())
+    rslt.append(df_optima)
+
+    return rslt
+
+
+def estimate_start(args):
+    """This function estimates the model from a single starting point in its own directory. It is
+    the task for each worker in the multistart estimation."""
+    dirname, model_obj = args
+
+    cwd = os.getcwd()
+    os.chdir(dirname)
+
+    try:
+        model_obj.write_out('start.interalpy.ini')
+        rslt = estimate_model(model_obj)
+    finally:
+        os.chdir(cwd)
+
+    return rslt
@@ -0,0 +1,104 @@
+"""This module contains the class for the binary history of the estimation."""
+import struct
+import time
+import os
+
+import numpy as np
+
+from interalpy.custom_exceptions import InteralpyError
+from interalpy.config_interalpy import HISTORY_DTYPE
+from interalpy.config_interalpy import NUM_WARNINGS
+from interalpy.shared.clsBase import BaseCls
+
+
+class HistoryCls(BaseCls):
+    """This class manages the history of all evaluations during an estimation. It is stored as a
+    memory-mapped structured array, which is preallocated and can be read at any time with
+    np.load() or read_history(). The array doubles in size whenever it is full. The file is only
+    ever extended in place, so that the mappings of any concurrent readers remain valid."""
+    def __init__(self, fname, num_rows, is_resume=False):
+        self.attr = dict()
+
+        self.attr['fname'] = fname
+
+        # We continue the history of an earlier estimation run if it is available.
+        if is_resume and os.path.exists(fname):
+            records = np.lib.format.open_memmap(fname, mode='r+')
+
+            is_valid = records.dtype == np.dtype(HISTORY_DTYPE)
+            is_valid = is_valid and records.offset == len(self._get_header(0))
+            if not is_valid:
+                raise InteralpyError('history file has an incompatible format')
+
+            self.attr['records'] = records
+        else:
+            self._allocate(max(num_rows, 1), 'wb+')
+
+    def append(self, num_eval, fval, x_econ_all, x_optim_all, errors):
+        """This method records a single evaluation, where the evaluation index determines the
+        row of the array."""
+        # Distribute class attributes
+        records = self.attr['records']
+
+        if num_eval > records.shape[0]:
+            records = self._allocate(max(num_eval, 2 * records.shape[0]), 'rb+')
+
+        warnings = np.zeros(NUM_WARNINGS, dtype=np.int64)
+        for error_code, count in errors.items():
+            warnings[error_code] = count
+
+        row = records[num_eval - 1]
+        row['f_current'], row['time'] = fval, time.time()
+        row['x_econ_all'], row['x_optim_all'] = x_econ_all, x_optim_all
+        row['warnings'] = warnings
+
+        # The index is written last, so that a row is only considered once it is complete.
+        row['num_eval'] = num_eval
+
+    def truncate(self, num_eval):
+        """This method discards all records after the requested evaluation. This is required when
+        resuming an estimation run from a checkpoint that was written before its interruption."""
+        self.attr['records']['num_eval'][num_eval:] = 0
+
+    def flush(self):
+        """This method ensures that all records are written to disk."""
+        self.attr['records'].flush()
+
+    def _allocate(self, num_rows, mode):
+        """This method sets the number of rows of the array on disk and maps it to memory. The
+        existing records are kept as the header has a fixed size and the file only grows."""
+        # Distribute class attributes
+        fname = self.attr['fname']
+
+        if 'records' in self.attr.keys():
+            self.attr['records'].flush()
+            del self.attr['records']
+
+        header = self._get_header(num_rows)
+        size = len(header) + num_rows * np.dtype(HISTORY_DTYPE).itemsize
+
+        with open(fname, mode) as outfile:
+            outfile.write(header)
+            outfile.seek(size - 1)
+            outfile.write(b'\0')
+
+        self.attr['records'] = np.memmap(fname, dtype=HISTORY_DTYPE, mode='r+',
+            offset=len(header), shape=(num_rows,))
+
+        return self.attr['records']
+
+    @staticmethod
+    def _get_header(num_rows):
+        """This method returns the header of the file in the NPY format. We reserve enough space
+        for any number of rows, so that the header never changes its size."""
+        descr = np.lib.format.dtype_to_descr(np.dtype(HISTORY_DTYPE))
+        header = "{'descr': %r, 'fortran_order': False, 'shape': (%d,), }"
+
+        # The header consists of the magic string, its length, and the dictionary terminated by a
+        # newline. Its total size needs to be a multiple of 64 bytes.
+        size = 10 + len(header % (descr, np.iinfo(np.int64).max)) + 1
+        size = 64 * int(np.ceil(size / 64))
+
+        string = (header % (descr, num_rows)).ljust(size - 11) + '\n'
+
+        return np.lib.format.magic(1, 0) + struct.pack('<H', size - 10) + string.encode('latin1')
@@ -0,0 +1,73 @@
+"""This module contains the class for the buffered logging of the estimation."""
+import collections
+import shutil
+import gzip
+import time
+import os
+
+from interalpy.shared.clsBase import BaseCls
+from interalpy import config_interalpy
+
+
+class LogBufferCls(BaseCls):
+    """This class manages a bounded buffer of log entries in memory. The entries are appended to
+    the log file once the buffer is full or a certain time has passed since the last flush. All
+    settings that are not requested explicitly are read from the configuration at construction."""
+    def __init__(self, fname, flush_evals=None, flush_time=None, max_bytes=None):
+        self.attr = dict()
+
+        if flush_evals is None:
+            flush_evals = config_interalpy.LOG_FLUSH_EVALS
+        if flush_time is None:
+            flush_time = config_interalpy.LOG_FLUSH_TIME
+        if max_bytes is None:
+            max_bytes = config_interalpy.LOG_MAX_BYTES
+
+        self.attr['entries'] = collections.deque(maxlen=max(flush_evals, 1))
+        self.attr['last_flush'] = time.time()
+        self.attr['flush_time'] = flush_time
+        self.attr['max_bytes'] = max_bytes
+        self.attr['fname'] = fname
+
+    def add_entry(self, entry):
+        """This method adds an entry to the buffer and returns whether a flush is due."""
+        # Distribute class attributes
+        entries = self.attr['entries']
+
+        entries.append(entry)
+
+        is_full = len(entries) == entries.maxlen
+        is_late = (time.time() - self.attr['last_flush']) >= self.attr['flush_time']
+
+        return is_full or is_late
+
+    def flush(self):
+        """This method appends all entries in the buffer to the log file."""
+        # Distribute class attributes
+        max_bytes = self.attr['max_bytes']
+        entries = self.attr['entries']
+        fname = self.attr['fname']
+
+        with open(fname, 'a') as outfile:
+            outfile.write(''.join(entries))
+
+        entries.clear()
+        self.attr['last_flush'] = time.time()
+
+        if max_bytes is not None and os.path.getsize(fname) > max_bytes:
+            self._rotate()
+
+    def _rotate(self):
+        """This method compresses the log file and starts a new one."""
+        # Distribute class attributes
+        fname = self.attr['fname']
+
+        count = 1
+        while os.path.exists('{:}.{:}.gz'.format(fname, count)):
+            count += 1
+
+        with open(fname, 'rb') as infile:
+            with gzip.open('{:}.{:}.gz'.format(fname, count), 'wb') as outfile:
+                shutil.copyfileobj(infile, outfile)
+
+        open(fname, 'w').close()
@@ -6,19 +6,19 @@ class LoggerCls(BaseCls):
     """This class manages the logging of events."""
     def __init__(self):
         self.attr = dict()
-        self.attr['errors'] = []
+        self.attr['errors'] = dict()
 
-    def record_event(self, error_code):
-        """This method records the error codes of events."""
-        self.attr['errors'].append(error_code)
+    def record_event(self, error_code, count=1):
+        """This method records the error codes of events and how often they occurred."""
+        self.attr['errors'][error_code] = self.attr['errors'].get(error_code, 0) + int(count)
 
     def flush(self, outfile):
         """This method records all things related to an evaluation"""
-        for error_code in set(self.attr['errors']):
+        for error_code in sorted(self.attr['errors'].keys()):
             msg = '\n Warning: '
 
             if error_code == 0:
-                msg += 'Overflow, FloatingPoint errors in luce_prob()'
+                msg += 'Non-finite differences in utilities in luce_prob()'
             elif error_code == 1:
                 msg += 'small adjustment to bounds in to_real()'
             elif error_code == 2:
@@ -26,10 +26,12 @@ class LoggerCls(BaseCls):
             else:
                 raise NotImplementedError
 
+            msg += ' ({} cases)'.format(self.attr['errors'][error_code])
+
             outfile.write(msg + '\n')
 
         # Reset the container for the error cases.
-        self.attr['errors'] = []
+        self.attr['errors'] = dict()
 
 
 logger_obj = LoggerCls()
@@ -4,6 +4,7 @@ import os
 
 import pandas as pd
 
+from interalpy.shared.shared_auxiliary import write_grid
 from interalpy.config_interalpy import DATA_DTYPES
 
 # I need to create a fixed grid for the questions that is used throughout the package. This will
@@ -14,4 +15,4 @@ code = df['Participant.code'].values[0]
 grid = df[df['Participant.code'] == code].copy(deep=True)
 grid = grid.astype(DATA_DTYPES)
 grid.set_index(['Participant.code', 'Question', 'm'], inplace=True, drop=False)
-grid.to_pickle('grid.interalpy.pkl',  protocol=2)
+write_grid(grid, 'grid.interalpy.npz')
@@ -103,6 +103,36 @@ class ParasCls(BaseCls):
 
         return values
 
+    def get_jacobian(self, x_optim_free):
+        """This method returns the derivatives of the free economic parameters with respect to
+        the parameters used by the optimizer. As each economic parameter only depends on its own
+        counterpart, we only return the diagonal elements. We evaluate the derivatives directly at
+        the values of the optimizer, so there is no need to map the economic parameters back to the
+        real line."""
+        # Distribute class attributes
+        para_objs = self.attr['para_objs']
+
+        # Initialize containers
+        values = list()
+
+        count = 0
+
+        for label in PARA_LABELS:
+            for para_obj in para_objs:
+                # We are only interested in the free parameters.
+                if para_obj.get_attr('is_fixed'):
+                    continue
+                # We are only interested in one particular parameter.
+                if label != para_obj.get_attr('label'):
+                    continue
+
+                lower, upper = para_obj.get_attr('bounds')
+                values += [self._to_interval_derivative(x_optim_free[count], lower, upper)]
+
+                count += 1
+
+        return values
+
     def check_integrity(self):
         """This method checks some basic features of the class that need to hold true at all
         times."""
@@ -130,13 +160,30 @@ class ParasCls(BaseCls):
     @staticmethod
     def _to_interval(val, lower, upper):
         """This function maps any value to a bounded interval."""
-        try:
-            exponential = np.exp(-val)
-        except (OverflowError, FloatingPointError) as _:
-            exponential = HUGE_FLOAT
-            logger_obj.record_event(2)
+        with np.errstate(over='ignore'):
+            exponential = np.exp(-np.array(val, dtype=float))
+
+        is_overflow = ~np.isfinite(exponential)
+        if np.any(is_overflow):
+            logger_obj.record_event(2, np.sum(is_overflow))
+        exponential = np.where(is_overflow, HUGE_FLOAT, exponential)
+
+        interval = upper - lower
+        value = lower + interval / (1 + exponential)
+
+        # We return a scalar if the transformation is requested for a single value only.
+        if np.ndim(value) == 0:
+            value = float(value)
+
+        return value
+
+    @staticmethod
+    def _to_interval_derivative(val, lower, upper):
+        """This function returns the derivative of the mapping to a bounded interval. We use a
+        formulation that cannot overflow."""
+        exponential = np.exp(-abs(val))
         interval = upper - lower
-        return lower + interval / (1 + exponential)
+        return interval * exponential / (1 + exponential) ** 2
 
     @staticmethod
     def _to_real(value, lower, upper):
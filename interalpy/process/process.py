@@ -3,22 +3,36 @@ import os
 
 import pandas as pd
 
+from interalpy.process.process_auxiliary import construct_counts
+from interalpy.shared.shared_auxiliary import construct_grid_index
 from interalpy.process.process_auxiliary import test_integrity
+from interalpy.process.process_auxiliary import read_records
 from interalpy.custom_exceptions import InteralpyError
 
 
 def process(est_file, est_agents):
-    """This function processes the observed dataset."""
+    """This function processes the observed dataset. We also return the number of choices for
+    each lottery in each cell of the grid as they are sufficient for the estimation."""
     # We read in the estimation dataset.
     if not os.path.exists(est_file):
         raise InteralpyError('estimation dataset does not exist')
 
-    df = pd.read_pickle(est_file)
+    # We also support simulated datasets that were written in chunks.
+    if est_file.endswith('.npy'):
+        df = read_records(est_file)
+    else:
+        df = pd.read_pickle(est_file)
 
     test_integrity(df, est_agents)
 
     # We might want to estimate on a subset of individuals only.
     subset = df['Participant.code'].unique()[:est_agents]
-    df = df.loc[(subset, slice(None), slice(None)), :]
+    df = df.loc[(subset, slice(None), slice(None)), :].copy()
 
-    return df
+    # We map each observation to its cell in the grid once, so that the evaluation of the
+    # criterion function does not require any merging of the data.
+    df['grid_idx'] = construct_grid_index(df)
+
+    df_counts = construct_counts(df)
+
+    return df, df_counts
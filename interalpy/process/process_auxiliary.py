@@ -1,9 +1,44 @@
 """This module contains some auxiliary functions to the processing of the observed dataset."""
+import pandas as pd
 import numpy as np
 
+from interalpy.shared.shared_auxiliary import get_grid
+
 
 def test_integrity(df, est_agents):
     """This function tests the integrity of the estimation dataset."""
     # Does the number of requested individuals line up with the number available?
     stat = df['Participant.code'].nunique()
     np.testing.assert_equal(stat >= est_agents, True)
+
+
+def read_records(fname):
+    """This function reads a dataset that is stored as a structured array."""
+    records = np.load(fname, mmap_mode='r')
+
+    df = pd.DataFrame()
+    for label in records.dtype.names:
+        df[label] = records[label]
+
+    df.set_index(['Participant.code', 'Question', 'm'], inplace=True, drop=False)
+
+    return df
+
+
+def construct_counts(df):
+    """This function constructs the number of choices for lottery A and B for each cell of the
+    grid. The table is aligned with the rows of the grid and observations outside the grid are
+    not included."""
+    grid = get_grid()
+
+    num_cells = grid['Question'].shape[0]
+
+    is_grid = df['grid_idx'].values > -1
+    idx, choice = df['grid_idx'].values[is_grid], df['D'].values[is_grid]
+
+    df_counts = pd.DataFrame()
+    df_counts['Question'], df_counts['m'] = grid['Question'].copy(), grid['m'].copy()
+    df_counts['n_A'] = np.bincount(idx, weights=choice, minlength=num_cells).astype(np.int64)
+    df_counts['n_B'] = np.bincount(idx, weights=1 - choice, minlength=num_cells).astype(np.int64)
+
+    return df_counts
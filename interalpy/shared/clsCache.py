@@ -0,0 +1,66 @@
+"""This module contains the class for the cache of the grid solutions."""
+import collections
+
+from interalpy.config_interalpy import CACHE_SIZE
+from interalpy.shared.clsBase import BaseCls
+
+
+class CacheCls(BaseCls):
+    """This class manages a bounded cache, where the least recently used entries are discarded
+    first. The keys are the exact values of the parameters."""
+    def __init__(self, max_size):
+        self.attr = dict()
+
+        self.attr['entries'] = collections.OrderedDict()
+        self.attr['max_size'] = max_size
+        self.attr['misses'] = 0
+        self.attr['hits'] = 0
+
+    def get_entry(self, key):
+        """This method returns the entry for the key and None if it is not available."""
+        # Distribute class attributes
+        entries = self.attr['entries']
+
+        if key not in entries.keys():
+            self.attr['misses'] += 1
+            return None
+
+        self.attr['hits'] += 1
+        entries.move_to_end(key)
+
+        return entries[key]
+
+    def set_entry(self, key, value):
+        """This method adds an entry to the cache and discards the least recently used entries
+        if the cache is full."""
+        # Distribute class attributes
+        max_size = self.attr['max_size']
+        entries = self.attr['entries']
+
+        if max_size == 0:
+            return
+
+        entries[key] = value
+        entries.move_to_end(key)
+
+        while len(entries) > max_size:
+            entries.popitem(last=False)
+
+    def set_max_size(self, max_size):
+        """This method changes the maximum number of entries in the cache."""
+        self.attr['max_size'] = max_size
+
+        while len(self.attr['entries']) > max_size:
+            self.attr['entries'].popitem(last=False)
+
+    def clear(self):
+        """This method removes all entries and resets the statistics."""
+        self.attr['entries'] = collections.OrderedDict()
+        self.attr['misses'] = 0
+        self.attr['hits'] = 0
+
+
+# We cache the solutions of the grid and separately the expected utilities, which do not depend on
+# the parameter of the Luce model.
+cache_obj = CacheCls(CACHE_SIZE)
+cache_eu_obj = CacheCls(CACHE_SIZE)
@@ -7,8 +7,16 @@ import copy
 import pandas as pd
 import numpy as np
 
+from interalpy.config_interalpy import GRID_DTYPES
+from interalpy.config_interalpy import GRID_LABELS
 from interalpy.config_interalpy import PACKAGE_DIR
+from interalpy.config_interalpy import NUM_PARAS
+from interalpy.config_interalpy import BACKEND
 from interalpy.logging.clsLogger import logger_obj
+from interalpy.shared.shared_compiled import get_criterion_kernel
+from interalpy.shared.shared_compiled import IS_NUMBA
+from interalpy.shared.clsCache import cache_eu_obj
+from interalpy.shared.clsCache import cache_obj
 from interalpy.config_interalpy import HUGE_FLOAT
 from interalpy.config_interalpy import TINY_FLOAT
 
@@ -18,24 +26,133 @@ def solve_grid(r, eta, b, nu):
     dataset."""
     # Since all individuals are equivalent, we can  simply restrict attention to the choices
     # in the from of a grid.
-    grid = pd.read_pickle(PACKAGE_DIR + '/material/grid.interalpy.pkl')
+    grid = get_grid()
+
+    solution = solve_grid_arrays(r, eta, b, nu)
+
+    # We restrict attention to only a subset of information.
+    df_grid = pd.DataFrame()
+    df_grid['Question'], df_grid['m'] = grid['Question'].copy(), grid['m'].copy()
+    for label in ['prob_a', 'prob_b', 'eu_a', 'eu_b']:
+        df_grid[label] = solution[label].copy()
+
+    df_grid.set_index(['Question', 'm'], inplace=True, drop=False)
+
+    return df_grid
+
+
+def solve_grid_arrays(r, eta, b, nu):
+    """This function solves the grid of the model and returns the expected utilities and choice
+    probabilities as arrays aligned with the rows of the grid. The solutions for single
+    parameterizations are cached, so all arrays are read-only."""
+    is_batch = np.ndim(r) > 0
+
+    events_start = logger_obj.get_attr('errors').copy()
+
+    # The expected utilities do not depend on nu, so we cache them separately. This way a change
+    # in nu only requires the choice probabilities to be updated. We store the events recorded
+    # during the solution alongside, so they are recorded again whenever the entry is reused.
+    utilities = None
+    if not is_batch:
+        key = (float(r), float(eta), float(b), float(nu))
+        entry = cache_obj.get_entry(key)
+        if entry is not None:
+            solution, events = entry
+            record_events(events)
+            return solution
+        entry = cache_eu_obj.get_entry(key[:3])
+        if entry is not None:
+            utilities, events_eu = entry
+            record_events(events_eu)
 
     # We now calculate the expected utilities for each choice for the given parameterization of
-    # the model.
-    construct_expected_utilities_row = functools.partial(construct_expected_utilities, r, eta, b)
-    grid = grid.apply(construct_expected_utilities_row, axis=1)
+    # the model. All computations are done for the whole grid at once.
+    if utilities is None:
+        with np.errstate(all='ignore'):
+            utilities = construct_expected_utilities(get_grid(), r, eta, b)
+        if not is_batch:
+            for array in utilities:
+                array.setflags(write=False)
+            events_eu = get_events(events_start)
+            cache_eu_obj.set_entry(key[:3], (utilities, events_eu))
+
+    eu_a, eu_b = utilities
 
     # We are ready to construct the choice probabilites based on Luce's (1959) model.
-    construct_choice_probabilities_row = functools.partial(construct_choice_probabilities, nu)
-    grid = grid.apply(construct_choice_probabilities_row, axis=1)
+    log_prob_a, log_prob_b = luce_log_prob(eu_a, eu_b, nu)
+
+    with np.errstate(under='ignore'):
+        prob_a, prob_b = np.exp(log_prob_a), np.exp(log_prob_b)
+
+    solution = dict()
+    solution['eu_a'], solution['eu_b'] = eu_a, eu_b
+    solution['prob_a'], solution['prob_b'] = prob_a, prob_b
+    solution['log_prob_a'], solution['log_prob_b'] = log_prob_a, log_prob_b
+
+    if not is_batch:
+        for label in solution.keys():
+            solution[label].setflags(write=False)
+        events = get_events(events_start)
+        cache_obj.set_entry(key, (solution, events))
+
+    return solution
+
+
+def get_events(events_start):
+    """This function returns the events recorded since the logger was in the requested state."""
+    events = dict()
+    for error_code, count in logger_obj.get_attr('errors').items():
+        count -= events_start.get(error_code, 0)
+        if count > 0:
+            events[error_code] = count
+
+    return events
+
+
+def record_events(events):
+    """This function records a collection of events again."""
+    for error_code, count in events.items():
+        logger_obj.record_event(error_code, count)
 
-    # We restrict attention to only a subset of information.
-    grid.set_index(['Question', 'm'], inplace=True, drop=False)
-    grid = grid[['Question', 'm', 'prob_a', 'prob_b', 'eu_a', 'eu_b']]
+
+@functools.lru_cache(maxsize=None)
+def get_grid():
+    """This function returns the grid of choices. It is only read from disk once per process and
+    all arrays are read-only as they are shared throughout the package."""
+    return read_grid(PACKAGE_DIR + '/material/grid.interalpy.npz')
+
+
+def read_grid(fname):
+    """This function reads the grid of choices from disk. We also support the legacy pickle
+    format, which is tied to the version of pandas that created it."""
+    if fname.endswith('.pkl'):
+        df = pd.read_pickle(fname)
+        grid = {label: df[label].values for label in GRID_LABELS}
+    else:
+        with np.load(fname, allow_pickle=False) as infile:
+            grid = {label: infile[label] for label in GRID_LABELS}
+
+    for label in GRID_LABELS:
+        grid[label] = np.array(grid[label], dtype=GRID_DTYPES[label])
+        grid[label].setflags(write=False)
 
     return grid
 
 
+def write_grid(grid, fname):
+    """This function writes the grid of choices to disk in a version-independent array format."""
+    arrays = dict()
+    for label in GRID_LABELS:
+        arrays[label] = np.array(grid[label], dtype=GRID_DTYPES[label])
+
+    np.savez(fname, **arrays)
+
+
+def convert_grid(fname_pkl, fname_npz):
+    """This function converts a grid of choices stored in the legacy pickle format."""
+    write_grid(read_grid(fname_pkl), fname_npz)
+
+
 def dist_class_attributes(model_obj, *args):
     """ This function distributes a host of class attributes.
     """
@@ -61,91 +178,117 @@ def atemporal_utility(payments, r, eta, b):
     return (u ** (1 - eta)) / (1 - eta)
 
 
+def atemporal_utility_derivatives(payments, r, eta, b):
+    """This function calculates the derivatives of the atemporal utility with respect to the
+    preference parameters r, eta, and b."""
+    own, charity = payments
+
+    def power_derivative(z):
+        """This function returns the derivative of z ** (1 - r) / (1 - r) with respect to r,
+        where we use that it approaches zero as z approaches zero."""
+        rslt = (z ** (1 - r) / (1 - r)) * (1 / (1 - r) - np.log(z))
+        return np.where(z > 0, rslt, 0.0)
+
+    with np.errstate(all='ignore'):
+        u = (own ** (1 - r) / (1 - r)) + b * (charity ** (1 - r) / (1 - r))
+        marginal = u ** (-eta)
+
+        derivs = dict()
+        derivs['r'] = marginal * (power_derivative(own) + b * power_derivative(charity))
+        derivs['eta'] = ((u ** (1 - eta)) / (1 - eta)) * (1 / (1 - eta) - np.log(u))
+        derivs['b'] = marginal * (charity ** (1 - r) / (1 - r))
+
+    return derivs
+
+
 def luce_prob(u_x, u_y, nu):
     """This function computes the choice probabilites using Luce's model."""
-    try:
-        x = u_x ** (1 / nu)
-    except (OverflowError, FloatingPointError) as _:
-        logger_obj.record_event(0)
-        x = HUGE_FLOAT
-    try:
-        y = u_y ** (1 / nu)
-    except (OverflowError, FloatingPointError) as _:
-        logger_obj.record_event(0)
-        y = HUGE_FLOAT
-
-    prob = x / (x + y)
-    return prob, 1 - prob
-
-
-def construct_choice_probabilities(nu, row):
-    """This function returns the expected utility from both lotteries."""
-    row['prob_a'], row['prob_b'] = np.nan, np.nan
-    row[['prob_a', 'prob_b']] = luce_prob(row['eu_a'], row['eu_b'], nu)
-    return row
+    log_prob_x, log_prob_y = luce_log_prob(u_x, u_y, nu)
 
+    with np.errstate(under='ignore'):
+        prob_x, prob_y = np.exp(log_prob_x), np.exp(log_prob_y)
 
-def construct_expected_utilities(r, eta, b, row):
-    """This function returns the expected utility from both lotteries."""
-    if row['Question'] in [1, 2, 3]:
-        eu_a = 0
+    return prob_x, prob_y
 
-        payments = (row['x'] + row['I1'], row['y'])
-        eu_a += 0.5 * atemporal_utility(payments, r, eta, b)
 
-        payments = (row['x'] + row['I2'], row['y'])
-        eu_a += 0.5 * atemporal_utility(payments, r, eta, b)
+def luce_diff(u_x, u_y, nu):
+    """This function computes the scaled difference in the log-utilities of both alternatives,
+    which determines the choice probabilities in Luce's model."""
+    return (np.log(u_y) - np.log(u_x)) / nu
 
-        eu_b = 0
 
-        payments = (row['x'] + row['I1'] + row['I2'] + row['m'], row['y'])
-        eu_b += 0.5 * atemporal_utility(payments, r, eta, b)
+def luce_log_prob(u_x, u_y, nu):
+    """This function computes the logarithm of the choice probabilities using Luce's model. We
+    work in log-space throughout, so that the probabilities are accurate even for small values
+    of nu."""
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore', under='ignore'):
+        diff = luce_diff(u_x, u_y, nu)
 
-        payments = (row['x'] + row['m'], row['y'])
-        eu_b += 0.5 * atemporal_utility(payments, r, eta, b)
+        # We cannot distinguish the alternatives if both utilities are not well defined.
+        is_invalid = ~np.isfinite(diff)
+        if np.any(is_invalid):
+            logger_obj.record_event(0, np.sum(is_invalid))
+        diff = np.where(np.isnan(diff), 0.0, diff)
 
-    elif row['Question'] in [4, 5, 6]:
+        log_prob_x, log_prob_y = -np.logaddexp(0.0, diff), -np.logaddexp(0.0, -diff)
 
-        eu_a = 0
+    return log_prob_x, log_prob_y
 
-        payments = (row['x'], row['y'] + row['I1'])
-        eu_a += 0.5 * atemporal_utility(payments, r, eta, b)
 
-        payments = (row['x'], row['y'] + row['I2'])
-        eu_a += 0.5 * atemporal_utility(payments, r, eta, b)
+def construct_payments(grid):
+    """This function returns the payments for the two equally likely outcomes of both lotteries.
+    Each payment is a tuple with the columns for the own and the charity payment."""
+    x, y, m, i1, i2 = [grid[label] for label in ['x', 'y', 'm', 'I1', 'I2']]
+    question = grid['Question']
 
-        eu_b = 0
+    # The payments for the own account, the charity account, and the mixed questions.
+    is_own = np.in1d(question, [1, 2, 3])
+    is_charity = np.in1d(question, [4, 5, 6])
+    is_mixed = np.in1d(question, [7, 8, 9])
 
-        payments = (row['x'], row['y'] + row['I1'] + row['I2'] + row['m'])
-        eu_b += 0.5 * atemporal_utility(payments, r, eta, b)
+    np.testing.assert_equal(np.all(is_own | is_charity | is_mixed), True)
 
-        payments = (row['x'], row['y'] + row['m'])
-        eu_b += 0.5 * atemporal_utility(payments, r, eta, b)
+    cases = dict()
+    cases['a_1'] = [(x + i1, y), (x, y + i1), (x + i1, y)]
+    cases['a_2'] = [(x + i2, y), (x, y + i2), (x, y + i2)]
+    cases['b_1'] = [(x + i1 + i2 + m, y), (x, y + i1 + i2 + m), (x + i1 + m, y + i2)]
+    cases['b_2'] = [(x + m, y), (x, y + m), (x + m, y)]
 
-    elif row['Question'] in [7, 8, 9]:
+    payments = dict()
+    for label in cases.keys():
+        own = np.select([is_own, is_charity, is_mixed], [case[0] for case in cases[label]])
+        charity = np.select([is_own, is_charity, is_mixed], [case[1] for case in cases[label]])
+        payments[label] = (own, charity)
 
-        eu_a = 0
+    return payments
 
-        payments = (row['x'] + row['I1'], row['y'])
-        eu_a += 0.5 * atemporal_utility(payments, r, eta, b)
 
-        payments = (row['x'], row['y'] + row['I2'])
-        eu_a += 0.5 * atemporal_utility(payments, r, eta, b)
+def construct_expected_utilities(grid, r, eta, b):
+    """This function returns the expected utility from both lotteries."""
+    payments = construct_payments(grid)
 
-        eu_b = 0
+    eu_a = 0.5 * atemporal_utility(payments['a_1'], r, eta, b)
+    eu_a += 0.5 * atemporal_utility(payments['a_2'], r, eta, b)
 
-        payments = (row['x'] + row['I1'] + row['m'], row['y'] + row['I2'])
-        eu_b += 0.5 * atemporal_utility(payments, r, eta, b)
+    eu_b = 0.5 * atemporal_utility(payments['b_1'], r, eta, b)
+    eu_b += 0.5 * atemporal_utility(payments['b_2'], r, eta, b)
 
-        payments = (row['x'] + row['m'], row['y'])
-        eu_b += 0.5 * atemporal_utility(payments, r, eta, b)
+    return eu_a, eu_b
 
-    else:
-        raise AssertionError
 
-    row['eu_a'], row['eu_b'] = eu_a, eu_b
+def construct_expected_utilities_derivatives(grid, r, eta, b):
+    """This function returns the derivatives of the expected utility from both lotteries with
+    respect to the preference parameters r, eta, and b."""
+    payments = construct_payments(grid)
+
+    derivs = dict()
+    for lottery in ['a', 'b']:
+        derivs_1 = atemporal_utility_derivatives(payments[lottery + '_1'], r, eta, b)
+        derivs_2 = atemporal_utility_derivatives(payments[lottery + '_2'], r, eta, b)
+        for label in ['r', 'eta', 'b']:
+            derivs[label, lottery] = 0.5 * derivs_1[label] + 0.5 * derivs_2[label]
 
-    return row
+    return derivs
 
 
 def get_random_string(size=6):
@@ -225,25 +368,205 @@ def format_coefficient_line(label, info, str_):
 def criterion_function(df, r, eta, b, nu):
     """This function evaluates the value of the criterion function for a given parameterization
     of the model."""
-    # We need to ensure that only information from an observed dataset is included.
-    df_est = df.copy(deep=True)
-    df_est = df_est[['Participant.code', 'Question', 'm', 'D']]
+    contribs = construct_contributions(df, r, eta, b, nu)
+
+    # Only observations that are part of the grid are included.
+    fval = -np.mean(contribs[np.isfinite(contribs)])
+
+    np.testing.assert_equal(np.isfinite(fval), True)
+
+    return fval
+
+
+def construct_contributions(df, r, eta, b, nu):
+    """This function returns the contribution of each observation to the log-likelihood. The
+    contribution is missing for all observations that are not part of the grid."""
+    # We rely on the mapping of each observation to its cell in the grid, which is constructed
+    # only once during the processing of the observed dataset.
+    if 'grid_idx' in df.columns:
+        grid_idx = df['grid_idx'].values
+    else:
+        grid_idx = construct_grid_index(df)
 
     # We start by simply solving for the alternative-specific choice probabilities.
-    grid = solve_grid(r, eta, b, nu)
+    solution = solve_grid_arrays(r, eta, b, nu)
 
-    # We can now simply merge the alternative specific-choice probabilities and select the relevant
-    # value for the likelihood evaluation.
-    df_est = pd.merge(df_est, grid, right_on=['Question', 'm'], left_on=['Question', 'm'])
+    is_grid = grid_idx > -1
+    idx, choice = grid_idx[is_grid], df['D'].values[is_grid]
 
-    df_est['prob'] = df_est['D'] * df_est['prob_a'] + (1 - df_est['D']) * df_est['prob_b']
-    fval = -np.mean(np.log(np.clip(df_est['prob'], TINY_FLOAT, np.inf)))
+    log_prob_a = np.clip(solution['log_prob_a'], np.log(TINY_FLOAT), np.inf)
+    log_prob_b = np.clip(solution['log_prob_b'], np.log(TINY_FLOAT), np.inf)
+
+    contribs = np.tile(np.nan, df.shape[0])
+    contribs[is_grid] = np.where(choice == 1, log_prob_a[idx], log_prob_b[idx])
+
+    return contribs
+
+
+def construct_grid_index(df):
+    """This function maps each observation to its row in the grid of choices. Observations that
+    are not part of the grid are assigned a value of minus one."""
+    grid = get_grid()
+
+    index = pd.MultiIndex.from_arrays([grid['Question'], grid['m']])
+    obs = pd.MultiIndex.from_arrays([df['Question'].values, df['m'].values])
+
+    return index.get_indexer(obs)
 
-    np.testing.assert_equal(np.isfinite(fval), True)
+
+def criterion_function_counts(df_counts, r, eta, b, nu):
+    """This function evaluates the value of the criterion function based on the number of choices
+    for each lottery in each cell of the grid. This is sufficient information for its evaluation
+    and its cost does not depend on the number of observations."""
+    solution = solve_grid_arrays(r, eta, b, nu)
+
+    fval = construct_criterion_counts(df_counts, solution)
 
     return fval
 
 
+def criterion_function_batch(df_counts, x_econ_all, is_events=False):
+    """This function evaluates the value of the criterion function for a whole batch of parameter
+    vectors at once. Each row of the array of economic parameters is a separate parameterization
+    and the grid is solved for all of them as a single array computation. If requested, the
+    events are not recorded but returned separately for each parameterization."""
+    x_econ_all = np.array(x_econ_all, dtype=float, ndmin=2)
+    np.testing.assert_equal(x_econ_all.shape[1], NUM_PARAS)
+
+    if BACKEND == 'NUMBA' and IS_NUMBA:
+        return criterion_function_batch_compiled(df_counts, x_econ_all, is_events)
+
+    errors = logger_obj.get_attr('errors').copy()
+
+    # The parameters are arranged along the first axis and the grid along the second axis.
+    r, eta, b, nu = [x_econ_all[:, [i]] for i in range(NUM_PARAS)]
+    solution = solve_grid_arrays(r, eta, b, nu)
+
+    fvals = construct_criterion_counts(df_counts, solution)
+
+    if not is_events:
+        return fvals
+
+    # The events are only recorded in total for the whole batch, so we count them again for
+    # each parameterization.
+    logger_obj.set_attr('errors', errors)
+
+    with np.errstate(all='ignore'):
+        diff = luce_diff(solution['eu_a'], solution['eu_b'], nu)
+
+    return fvals, get_events_batch(np.sum(~np.isfinite(diff), axis=1))
+
+
+def criterion_function_batch_compiled(df_counts, x_econ_all, is_events=False):
+    """This function evaluates the criterion function for a batch of parameter vectors using the
+    compiled kernel."""
+    x_econ_all = np.array(x_econ_all, dtype=float, ndmin=2)
+    n_a, n_b = df_counts['n_A'].values, df_counts['n_B'].values
+
+    payments = construct_payments(get_grid())
+
+    args = list()
+    for label in ['a_1', 'a_2', 'b_1', 'b_2']:
+        args += list(payments[label])
+    payments = np.array(args, dtype=float)
+
+    fvals, num_invalid = get_criterion_kernel()(x_econ_all, payments, n_a.astype(float),
+        n_b.astype(float), np.log(TINY_FLOAT))
+
+    np.testing.assert_equal(np.all(np.isfinite(fvals)), True)
+
+    if is_events:
+        return fvals, get_events_batch(num_invalid)
+
+    if np.sum(num_invalid) > 0:
+        logger_obj.record_event(0, np.sum(num_invalid))
+
+    return fvals
+
+
+def get_events_batch(num_invalid):
+    """This function returns the events for each parameterization in a batch based on the number
+    of cells with utilities that are not well defined."""
+    events = list()
+    for count in num_invalid:
+        events += [{0: int(count)} if count > 0 else dict()]
+
+    return events
+
+
+def construct_criterion_counts(df_counts, solution):
+    """This function constructs the value of the criterion function from the solution of the
+    grid, where the last axis of all arrays corresponds to the rows of the grid."""
+    n_a, n_b = df_counts['n_A'].values, df_counts['n_B'].values
+
+    log_prob_a = np.clip(solution['log_prob_a'], np.log(TINY_FLOAT), np.inf)
+    log_prob_b = np.clip(solution['log_prob_b'], np.log(TINY_FLOAT), np.inf)
+
+    fval = -(np.dot(log_prob_a, n_a) + np.dot(log_prob_b, n_b)) / (n_a.sum() + n_b.sum())
+
+    np.testing.assert_equal(np.all(np.isfinite(fval)), True)
+
+    return fval
+
+
+def construct_loglike_choices(choices, solution):
+    """This function returns the log-likelihood of the choices of each agent, where each row of
+    the solution of the grid corresponds to the parameters of one agent."""
+    log_prob_a = np.clip(solution['log_prob_a'], np.log(TINY_FLOAT), np.inf)
+    log_prob_b = np.clip(solution['log_prob_b'], np.log(TINY_FLOAT), np.inf)
+
+    return np.sum(np.where(choices == 1, log_prob_a, log_prob_b), axis=-1)
+
+
+def criterion_gradient_counts(df_counts, r, eta, b, nu):
+    """This function evaluates the analytic gradient of the criterion function with respect to
+    all economic parameters based on the number of choices in each cell of the grid. For a batch
+    of parameterizations, there is one row of the gradient for each of them."""
+    grid = get_grid()
+
+    n_a, n_b = df_counts['n_A'].values, df_counts['n_B'].values
+
+    solution = solve_grid_arrays(r, eta, b, nu)
+    derivs = construct_expected_utilities_derivatives(grid, r, eta, b)
+
+    # We need the derivative of the criterion function with respect to the scaled difference in
+    # the log-utilities that determines the choice probabilities. The contributions are constant
+    # whenever the probabilities are clipped.
+    is_clipped_a = solution['log_prob_a'] < np.log(TINY_FLOAT)
+    is_clipped_b = solution['log_prob_b'] < np.log(TINY_FLOAT)
+
+    deriv_diff = n_a * np.where(is_clipped_a, 0.0, solution['prob_b'])
+    deriv_diff -= n_b * np.where(is_clipped_b, 0.0, solution['prob_a'])
+    deriv_diff /= (n_a.sum() + n_b.sum())
+
+    eu_a, eu_b = solution['eu_a'], solution['eu_b']
+
+    derivs_grid = list()
+    for label in ['r', 'eta', 'b']:
+        derivs_grid += [(derivs[label, 'b'] / eu_b - derivs[label, 'a'] / eu_a) / nu]
+
+    derivs_grid += [-(np.log(eu_b) - np.log(eu_a)) / nu ** 2]
+
+    # We aggregate the contributions across the grid separately for each parameterization.
+    if np.ndim(r) == 0:
+        return np.array([np.dot(deriv_diff, deriv) for deriv in derivs_grid])
+
+    return np.stack([np.einsum('ij,ij->i', deriv_diff, deriv) for deriv in derivs_grid], axis=1)
+
+
+def criterion_gradient_batch(df_counts, x_econ_all):
+    """This function evaluates the analytic gradient of the criterion function for a whole batch
+    of parameter vectors at once. Each row of the array of economic parameters is a separate
+    parameterization and the result has one row for each of them."""
+    x_econ_all = np.array(x_econ_all, dtype=float, ndmin=2)
+    np.testing.assert_equal(x_econ_all.shape[1], NUM_PARAS)
+
+    # The parameters are arranged along the first axis and the grid along the second axis.
+    r, eta, b, nu = [x_econ_all[:, [i]] for i in range(NUM_PARAS)]
+
+    return criterion_gradient_counts(df_counts, r, eta, b, nu)
+
+
 def char_floats(floats):
     """This method ensures a pretty printing of all floats."""
     # We ensure that this function can also be called on for a single float value.
@@ -0,0 +1,93 @@
+"""This module contains the compiled kernel for the evaluation of the criterion function. It fuses
+the calculation of the utilities, the expected utilities, the choice probabilities, and the
+log-likelihood into a single pass over the parameter vectors and the grid, so that no temporary
+arrays are created. The kernel is only compiled on first request and the parameter vectors are
+then distributed across all available threads."""
+import importlib.util
+import functools
+import math
+
+import numpy as np
+
+# We check the availability of numba without importing it.
+IS_NUMBA = importlib.util.find_spec('numba') is not None
+
+
+def atemporal_utility_scalar(own, charity, r, eta, b):
+    """This function calculates the atemporal utility for a single payment."""
+    u = (own ** (1 - r) / (1 - r)) + b * (charity ** (1 - r) / (1 - r))
+    return (u ** (1 - eta)) / (1 - eta)
+
+
+def softplus_scalar(x):
+    """This function calculates log(1 + exp(x)) without any overflow."""
+    return max(x, 0.0) + math.log1p(math.exp(-abs(x)))
+
+
+def make_criterion_kernel(utility, softplus, prange):
+    """This function returns the kernel for the criterion function, which refers to the requested
+    versions of the helper functions and the parallel range."""
+    def criterion_kernel(x_econ_all, payments, n_a, n_b, log_tiny):
+        """This function evaluates the criterion function and counts the invalid cells of the
+        grid for each parameter vector. The payments are arranged by the outcomes (a_1, a_2, b_1,
+        b_2), where each outcome contributes a row for the own and the charity payment."""
+        num_points, num_cells = x_econ_all.shape[0], payments.shape[1]
+        num_obs = n_a.sum() + n_b.sum()
+
+        fvals = np.zeros(num_points)
+        num_invalid = np.zeros(num_points, dtype=np.int64)
+
+        for k in prange(num_points):
+            r, eta, b = x_econ_all[k, 0], x_econ_all[k, 1], x_econ_all[k, 2]
+            nu = x_econ_all[k, 3]
+
+            loglike = 0.0
+            for i in range(num_cells):
+                eu_a = 0.5 * utility(payments[0, i], payments[1, i], r, eta, b)
+                eu_a += 0.5 * utility(payments[2, i], payments[3, i], r, eta, b)
+
+                eu_b = 0.5 * utility(payments[4, i], payments[5, i], r, eta, b)
+                eu_b += 0.5 * utility(payments[6, i], payments[7, i], r, eta, b)
+
+                # We follow the NumPy engine in the treatment of utilities that are not well
+                # defined.
+                if eu_a > 0 and eu_b > 0:
+                    diff = (math.log(eu_b) - math.log(eu_a)) / nu
+                elif eu_a > 0 and eu_b == 0:
+                    diff = -np.inf
+                elif eu_a == 0 and eu_b > 0:
+                    diff = np.inf
+                else:
+                    diff = np.nan
+
+                if not math.isfinite(diff):
+                    num_invalid[k] += 1
+                    if math.isnan(diff):
+                        diff = 0.0
+
+                log_prob_a = max(-softplus(diff), log_tiny)
+                log_prob_b = max(-softplus(-diff), log_tiny)
+
+                loglike += n_a[i] * log_prob_a + n_b[i] * log_prob_b
+
+            fvals[k] = -loglike / num_obs
+
+        return fvals, num_invalid
+
+    return criterion_kernel
+
+
+# The kernel in pure Python serves as the reference for its compiled version.
+criterion_kernel = make_criterion_kernel(atemporal_utility_scalar, softplus_scalar, range)
+
+
+@functools.lru_cache(maxsize=None)
+def get_criterion_kernel():
+    """This function compiles the kernel for the criterion function. The compiled functions are
+    not cached on disk, as the directory of the installed package might be read-only."""
+    import numba
+
+    utility = numba.njit(atemporal_utility_scalar)
+    softplus = numba.njit(softplus_scalar)
+
+    return numba.njit(parallel=True)(make_criterion_kernel(utility, softplus, numba.prange))
@@ -3,60 +3,124 @@ specification."""
 import pandas as pd
 import numpy as np
 
+from interalpy.simulate.simulate_auxiliary import construct_counts_simulated
 from interalpy.shared.shared_auxiliary import dist_class_attributes
-from interalpy.simulate.simulate_auxiliary import format_integer
-from interalpy.simulate.simulate_auxiliary import sample_choice
-from interalpy.simulate.simulate_auxiliary import format_float
+from interalpy.simulate.simulate_auxiliary import construct_simulated
+from interalpy.simulate.simulate_auxiliary import simulate_chunks
 from interalpy.simulate.simulate_auxiliary import write_info
+from interalpy.simulate.simulate_auxiliary import get_chunks
+from interalpy.simulate.simulate_auxiliary import sample_choices
+from interalpy.simulate.simulate_auxiliary import write_txt
+from interalpy.shared.shared_auxiliary import construct_criterion_counts
+from interalpy.shared.shared_auxiliary import construct_loglike_choices
+from interalpy.shared.shared_auxiliary import solve_grid_arrays
 from interalpy.shared.shared_auxiliary import solve_grid
+from interalpy.config_interalpy import SIM_BLOCK_SIZE
+from interalpy.shared.shared_auxiliary import get_grid
+from interalpy.config_interalpy import NUM_PARAS
+from interalpy.custom_exceptions import InteralpyError
 from interalpy.clsModel import ModelCls
 
 
-def simulate(fname):
-    """This function simulated the model from an initialization file."""
+def simulate(fname, chunk_size=None, num_procs=None, is_text=True):
+    """This function simulated the model from an initialization file. If a chunk size is
+    requested, the dataset is streamed to <sim_file>.interalpy.npy instead and None is returned."""
     # Process initialization file
     model_obj = ModelCls(fname)
 
+    return simulate_model(model_obj, chunk_size, num_procs, is_text, is_write=True)
+
+
+def simulate_model(model_obj, chunk_size=None, num_procs=None, is_text=True, is_write=False):
+    """This function simulates the model directly from an instance of the model specification
+    and returns the simulated dataset. The simulated dataset and the information file are only
+    written to disk if requested, which is required for the chunked simulation."""
     # Distribute class attributes for further processing.
     paras_obj, sim_seed, sim_agents, sim_file = dist_class_attributes(model_obj, 'paras_obj',
         'sim_seed', 'sim_agents', 'sim_file')
 
+    if chunk_size is not None and not is_write:
+        raise InteralpyError('chunked simulation requires writing to disk')
+
     # Since all individuals are equivalent, we can  simply restrict attention to the choices
     # in the from of a grid.
     r, eta, b, nu = paras_obj.get_values('econ', 'all')
 
+    solution = solve_grid_arrays(r, eta, b, nu)
     grid = solve_grid(r, eta, b, nu)
 
-    np.random.seed(sim_seed)
+    is_stream = chunk_size is not None
+    if not is_stream:
+        chunk_size = max(sim_agents, 1)
 
-    df_simulated = []
-    for i, _ in enumerate(range(sim_agents)):
-        grid_agent = grid.copy(deep=True)
-        grid_agent['Participant.code'] = i
-        grid_agent = grid_agent.apply(sample_choice, axis=1)
-        df_simulated += [grid_agent]
+    chunks = get_chunks(grid, sim_agents, chunk_size, sim_seed, num_procs)
 
-    df_simulated = pd.concat(df_simulated)
+    if not is_stream:
+        # We sample the choices for all agents and the whole grid at once.
+        choices = [choices for _, choices in chunks]
+        choices = np.concatenate(choices) if choices else np.zeros((0, grid.shape[0]), int)
 
-    df_simulated['Participant.code'] = df_simulated['Participant.code'].astype(int)
-    df_simulated.set_index(['Participant.code', 'Question', 'm'], inplace=True, drop=False)
+        df_simulated = construct_simulated(grid, choices)
+        df_counts = construct_counts_simulated(grid, choices.sum(axis=0), sim_agents)
 
-    columns = ['Participant.code', 'Question', 'm', 'D', 'eu_a', 'eu_b', 'prob_a', 'prob_b']
-    df_simulated = df_simulated[columns]
+        if is_write and is_text:
+            with open(sim_file + '.interalpy.txt', 'w') as outfile:
+                write_txt(df_simulated, outfile)
 
-    df_simulated.sort_index(inplace=True, sort_remaining=True)
+        if is_write:
+            df_simulated.to_pickle(sim_file + '.interalpy.pkl')
+    else:
+        df_simulated = None
+        df_counts = simulate_chunks(grid, chunks, sim_agents, sim_file, is_text)
 
-    formats = []
-    formats += [format_integer, format_integer, format_float, format_integer, format_float]
-    formats += [format_float, format_float, format_float]
-    with open(sim_file + '.interalpy.txt', 'w') as file_:
-        df_simulated.to_string(file_, index=False, header=True, na_rep='.', formatters=formats)
+    if is_write:
+        fval = construct_criterion_counts(df_counts, solution)
+        write_info(df_counts, fval, sim_agents, sim_file, sim_seed, [r, eta, b, nu])
 
-    df_simulated['Question'] = df_simulated['Question'].astype(np.int)
-    df_simulated.to_pickle(sim_file + '.interalpy.pkl')
+    return df_simulated
 
-    write_info(df_simulated, sim_file, sim_seed, b, r, eta, nu)
 
-    return df_simulated
+def simulate_population(model_obj, x_econ_agents, is_write=False):
+    """This function simulates a population of agents that differ in their parameters, with one
+    row of economic parameters for each agent."""
+    x_econ_agents = np.array(x_econ_agents, dtype=float, ndmin=2)
+    np.testing.assert_equal(x_econ_agents.shape[1], NUM_PARAS)
+
+    sim_seed, sim_file = dist_class_attributes(model_obj, 'sim_seed', 'sim_file')
+
+    grid = pd.DataFrame({label: get_grid()[label] for label in ['Question', 'm']})
+    num_agents, num_cells = x_econ_agents.shape[0], grid.shape[0]
+
+    np.random.seed(sim_seed)
+
+    df_simulated, n_a, loglike = [], np.zeros(num_cells, dtype=np.int64), 0.0
+    for start in range(0, num_agents, SIM_BLOCK_SIZE):
+        x_econ_block = x_econ_agents[start:start + SIM_BLOCK_SIZE]
+
+        # The parameters are arranged along the first axis and the grid along the second axis.
+        solution = solve_grid_arrays(*[x_econ_block[:, [i]] for i in range(NUM_PARAS)])
+
+        choices = sample_choices(solution['prob_a'], solution['prob_b'], x_econ_block.shape[0])
+        df_simulated += [construct_simulated(grid, choices, start, solution)]
+
+        n_a += choices.sum(axis=0)
+        loglike += construct_loglike_choices(choices, solution).sum()
 
+    if df_simulated:
+        df_simulated = pd.concat(df_simulated)
+    else:
+        df_simulated = construct_simulated(grid, np.zeros((0, num_cells), int))
 
+    if is_write:
+        with open(sim_file + '.interalpy.txt', 'w') as outfile:
+            write_txt(df_simulated, outfile)
+
+        df_simulated.to_pickle(sim_file + '.interalpy.pkl')
+
+        # Each agent contributes to the criterion function with the solution of the grid for its
+        # own parameters.
+        df_counts = construct_counts_simulated(grid, n_a, num_agents)
+        fval = -loglike / (num_agents * num_cells)
+        write_info(df_counts, fval, num_agents, sim_file, sim_seed)
+
+    return df_simulated
@@ -1,27 +1,232 @@
 """This module contains auxiliary functions that are onlz related to the simulation of the model."""
+import multiprocessing
+
 import numpy as np
 import pandas as pd
 
-from interalpy.shared.shared_auxiliary import criterion_function
 from interalpy.config_interalpy import PARA_LABELS
+from interalpy.config_interalpy import SIM_DTYPES
+from interalpy.config_interalpy import SIM_BLOCK_SIZE
+from interalpy.config_interalpy import SIM_LABELS
+
+
+def sample_choices(prob_a, prob_b, num_agents):
+    """This function samples the choices of all agents for the whole grid at once from the
+    global random state. A choice of one indicates lottery A."""
+    cdf = prob_a / (prob_a + prob_b)
+    draws = np.random.random_sample((num_agents, prob_a.shape[-1]))
+
+    return (draws < cdf).astype(np.int64)
+
+
+def sample_choices_stream(prob_a, prob_b, num_agents, seed_seq):
+    """This function samples the choices of a block of agents from an independent random stream
+    that does not rely on the global random state."""
+    cdf = prob_a / (prob_a + prob_b)
+    draws = np.random.Generator(np.random.PCG64(seed_seq)).random((num_agents, prob_a.shape[-1]))
+
+    return (draws < cdf).astype(np.int64)
+
+
+def sample_block(args):
+    """This function samples the choices for a single block of agents. It is the task for each
+    worker in the parallel simulation."""
+    return sample_choices_stream(*args)
+
+
+def get_chunks(grid, num_agents, chunk_size, sim_seed, num_procs):
+    """This function yields the simulated choices chunk by chunk together with the number of the
+    first agent in each chunk. With multiple processes, each block of agents has its own random
+    stream, so the sample differs from the one drawn from the global random state."""
+    prob_a, prob_b = grid['prob_a'].values, grid['prob_b'].values
+
+    if num_procs is None:
+        np.random.seed(sim_seed)
+        for start in range(0, num_agents, chunk_size):
+            num_chunk = min(chunk_size, num_agents - start)
+            yield start, sample_choices(prob_a, prob_b, num_chunk)
+        return
+
+    starts = list(range(0, num_agents, SIM_BLOCK_SIZE))
+    seed_seqs = np.random.SeedSequence(sim_seed).spawn(len(starts))
+
+    tasks = list()
+    for start, seed_seq in zip(starts, seed_seqs):
+        num_block = min(SIM_BLOCK_SIZE, num_agents - start)
+        tasks += [(prob_a, prob_b, num_block, seed_seq)]
+
+    if num_procs == 1:
+        for start, task in zip(starts, tasks):
+            yield start, sample_block(task)
+    else:
+        with multiprocessing.Pool(num_procs) as pool:
+            for start, choices in zip(starts, pool.imap(sample_block, tasks)):
+                yield start, choices
+
+
+def construct_simulated(grid, choices, start=0, solution=None):
+    """This function constructs the simulated dataset from the solution of the grid and the
+    matrix of choices with one row for each agent. The agents are numbered from the start
+    value onwards. If the agents differ in their parameters, the solution of the grid for each
+    agent is passed with one row for each agent."""
+    num_agents, num_cells = choices.shape
+
+    df_simulated = pd.DataFrame()
+    df_simulated['Participant.code'] = np.repeat(np.arange(start, start + num_agents), num_cells)
+    for label in ['Question', 'm']:
+        df_simulated[label] = np.tile(grid[label].values, num_agents)
+    df_simulated['D'] = choices.reshape(-1)
+    for label in ['eu_a', 'eu_b', 'prob_a', 'prob_b']:
+        if solution is None:
+            df_simulated[label] = np.tile(grid[label].values, num_agents)
+        else:
+            df_simulated[label] = solution[label].reshape(-1)
+
+    df_simulated.set_index(['Participant.code', 'Question', 'm'], inplace=True, drop=False)
+    df_simulated.sort_index(inplace=True, sort_remaining=True)
+
+    return df_simulated
+
+
+def construct_counts_simulated(grid, n_a, num_agents):
+    """This function constructs the number of choices for lottery A and B for each cell of the
+    grid, where each agent faces all cells of the grid."""
+    df_counts = pd.DataFrame()
+    df_counts['Question'], df_counts['m'] = grid['Question'].values, grid['m'].values
+    df_counts['n_A'] = np.array(n_a, dtype=np.int64)
+    df_counts['n_B'] = num_agents - df_counts['n_A']
+
+    return df_counts
+
+
+def simulate_chunks(grid, chunks, num_agents, sim_file, is_text=True):
+    """This function appends each chunk of simulated choices to disk. We only keep track of the
+    running totals of the choices, which are returned. The human-readable dataset is only written
+    if requested."""
+    num_cells = grid.shape[0]
+
+    dtype = [(label, SIM_DTYPES[label]) for label in SIM_LABELS]
+    records = np.lib.format.open_memmap(sim_file + '.interalpy.npy', mode='w+', dtype=dtype,
+        shape=(num_agents * num_cells,))
 
+    n_a = np.zeros(num_cells, dtype=np.int64)
 
-def sample_choice(row):
-    """This function samples the choice for each row."""
-    row['D'] = np.random.choice([1, 0], p=[row['prob_a'], row['prob_b']])
-    return row
+    # We determine the widths of the columns for all agents at once, so that the chunks are
+    # aligned with each other.
+    widths = get_widths(grid, num_agents)
 
+    outfile = open(sim_file + '.interalpy.txt', 'w') if is_text else None
 
-def write_info(df, sim_file, sim_seed, b, r, eta, nu):
+    for start, choices in chunks:
+        n_a += choices.sum(axis=0)
+
+        df_chunk = construct_simulated(grid, choices, start)
+        if is_text:
+            write_txt(df_chunk, outfile, is_header=(start == 0), widths=widths)
+
+        rows = slice(start * num_cells, (start + choices.shape[0]) * num_cells)
+        for label in SIM_LABELS:
+            records[label][rows] = df_chunk[label].values
+
+    if is_text:
+        outfile.close()
+
+    records.flush()
+
+    return construct_counts_simulated(grid, n_a, num_agents)
+
+
+def write_txt(df, outfile, is_header=True, block_size=100000, widths=None):
+    """This function writes the simulated dataset in the fixed-width layout of
+    DataFrame.to_string(index=False). The widths of the columns are taken from the dataset itself
+    unless they are provided."""
+    # We format the distinct values of each column and right-justify them to a common width.
+    # The distinct values are determined by their bit pattern, as the formatting of 0.0 and
+    # -0.0 differs. The missing value is appended at the end of each table.
+    labels, codes, tables = df.columns.tolist(), [], []
+    for label, formatter in zip(labels, get_formatters()):
+        values = df[label].values
+        if values.dtype == np.float64:
+            code, uniques = pd.factorize(values.view(np.int64))
+            uniques = uniques.view(np.float64)
+        else:
+            code, uniques = pd.factorize(values)
+
+        strings = [formatter(val) for val in uniques] + [formatter(np.nan)]
+        if widths is None:
+            width = max([len(label)] + [len(string) for string in strings])
+        else:
+            width = widths[label]
+        strings = [string.rjust(width) for string in strings]
+
+        codes += [code]
+        tables += [np.array(strings, dtype='S').view(np.uint8).reshape(len(strings), width)]
+
+    header = ' '.join([label.rjust(table.shape[1]) for label, table in zip(labels, tables)])
+
+    num_rows = df.shape[0]
+    line_length = len(header) + 1
+
+    if is_header:
+        outfile.write(header)
+
+    for start in range(0, num_rows, block_size):
+        stop = min(start + block_size, num_rows)
+
+        # We start each line with a line break, so that the file does not end with one.
+        block = np.full((stop - start, line_length), ord(' '), dtype=np.uint8)
+        block[:, 0] = ord('\n')
+
+        pos = 1
+        for code, table in zip(codes, tables):
+            block[:, pos:pos + table.shape[1]] = table[code[start:stop]]
+            pos += table.shape[1] + 1
+
+        outfile.write(block.tobytes().decode('ascii'))
+
+
+def get_widths(grid, num_agents):
+    """This function determines the widths of the columns of the human-readable dataset for a
+    number of agents facing the whole grid. These are the very same widths that result from
+    writing the complete dataset at once."""
+    widths = dict()
+    for label, formatter in zip(SIM_LABELS, get_formatters()):
+        if label == 'Participant.code':
+            values = [max(num_agents - 1, 0)]
+        elif label == 'D':
+            values = [0, 1]
+        else:
+            values = grid[label].values
+
+        strings = [formatter(val) for val in values] + [formatter(np.nan)]
+        widths[label] = max([len(label)] + [len(string) for string in strings])
+
+    return widths
+
+
+def get_formatters():
+    """This function returns the formatters for the columns of the human-readable dataset."""
+    formats = []
+    formats += [format_integer, format_integer, format_float, format_integer, format_float]
+    formats += [format_float, format_float, format_float]
+
+    return formats
+
+
+def write_info(df_counts, fval, num_agents, sim_file, sim_seed, x_econ_all=None):
     """This function writes some basic information to file to ease inspection of dataset
-    properties."""
+    properties. The parameterization is only recorded if it is shared by all agents."""
+    # We compute the shares for all cells of the grid at once and only keep those with choices.
+    df_info = df_counts[['Question', 'm']].copy()
+    df_info['Share A'] = df_counts['n_A'] / (df_counts['n_A'] + df_counts['n_B'])
+    df_info = df_info[(df_counts['n_A'] + df_counts['n_B']).values > 0]
+    df_info = df_info.sort_values(['Question', 'm'])
 
     with open(sim_file + '.interalpy.info', 'w') as outfile:
         fmt_ = '\n {:<25}{:>20}\n'
-        stat = df['Participant.code'].nunique()
-        outfile.write(fmt_.format(*[' Number of Individuals', stat]))
+        outfile.write(fmt_.format(*[' Number of Individuals', num_agents]))
 
-        stat = '{:10.5f}'.format(criterion_function(df, r, eta, b, nu))
+        stat = '{:10.5f}'.format(fval)
         outfile.write(fmt_.format(*[' Criterion Function', stat]))
 
         outfile.write(fmt_.format(*[' Seed', sim_seed]))
@@ -29,11 +234,9 @@ def write_info(df, sim_file, sim_seed, b, r, eta, nu):
         string = '\n\n\n {:>15}{:>15}{:>15}{:>15}\n'
         outfile.write(string.format(*['Question', 'm', 'Share A', 'Share B']))
 
-        for question in sorted(df['Question'].unique()):
+        for question, df_question in df_info.groupby(df_info['Question'].values, sort=False):
             outfile.write('\n')
-            for m in sorted(df['m'].loc[:, question, :].unique()):
-                stat = df['D'].loc[:, question, m].mean()
-
+            for m, stat in df_question[['m', 'Share A']].values.tolist():
                 line = [question, m, stat, (1 - stat)]
 
                 string = ' {:>15}{:>15}{:>15.5f}{:>15.5f}\n'
@@ -41,13 +244,16 @@ def write_info(df, sim_file, sim_seed, b, r, eta, nu):
 
         outfile.write('\n')
 
+        if x_econ_all is None:
+            return
+
         outfile.write(fmt_.format(*[' Parameterization', '']))
         fmt_ = '\n {:>15}  {:<10}{:>15}\n'
 
         outfile.write(fmt_.format(*['Identifier','Label', 'Value']))
         outfile.write('\n')
 
-        for i, val in enumerate([r, eta, b, nu]):
+        for i, val in enumerate(x_econ_all):
             string = ' {:>15}  {:<10}{:>15.5f}\n'
             outfile.write(string.format(*[i,PARA_LABELS[i], val]))
 
@@ -1,11 +1,21 @@
 """This module contains some integration tests."""
+import pandas as pd
 import numpy as np
+import glob
+import os
 
 from interalpy.shared.shared_auxiliary import dist_class_attributes
 from interalpy.tests.test_auxiliary import get_random_init
 from interalpy.shared.shared_auxiliary import solve_grid
 from interalpy.tests.test_auxiliary import get_rmse
+from interalpy.estimate.estimate_auxiliary import read_checkpoint
+from interalpy.estimate.estimate_auxiliary import read_history
+from interalpy.process.process import process
+from interalpy import simulate_population
+from interalpy import simulate_model
 from interalpy import simulate
+from interalpy import multistart
+from interalpy import config_interalpy
 from interalpy import ModelCls
 from interalpy import estimate
 
@@ -51,4 +61,201 @@ def test_3():
         get_random_init(constr)
         simulate('test.interalpy.ini')
         estimate('test.interalpy.ini')
-        np.testing.assert_equal(get_rmse(), 0.0)
\ No newline at end of file
+        np.testing.assert_equal(get_rmse(), 0.0)
+
+
+def test_4():
+    """This test ensures that simulating the agents in chunks results in the very same dataset as
+    simulating all of them at once."""
+    for _ in range(5):
+        init_dict = get_random_init()
+        sim_file = init_dict['SIMULATION']['file']
+        sim_agents = init_dict['SIMULATION']['agents']
+
+        simulate('test.interalpy.ini')
+        df, df_counts = process(sim_file + '.interalpy.pkl', sim_agents)
+
+        rslt = dict()
+        for ext in ['txt', 'info']:
+            with open(sim_file + '.interalpy.' + ext, 'r') as infile:
+                rslt[ext] = infile.read()
+
+        simulate('test.interalpy.ini', chunk_size=np.random.randint(1, sim_agents + 2))
+        df_chunks, df_counts_chunks = process(sim_file + '.interalpy.npy', sim_agents)
+
+        for ext in ['txt', 'info']:
+            with open(sim_file + '.interalpy.' + ext, 'r') as infile:
+                np.testing.assert_equal(infile.read(), rslt[ext])
+
+        np.testing.assert_equal(df_chunks.values, df.values)
+        np.testing.assert_equal(df_counts_chunks.values, df_counts.values)
+
+
+def test_5():
+    """This test ensures that the parallel simulation results in the very same dataset
+    regardless of the number of processes and whether the agents are streamed to disk."""
+    for _ in range(3):
+        constr = dict()
+        constr['num_agents'] = np.random.randint(1, 2500)
+        init_dict = get_random_init(constr)
+        sim_file = init_dict['SIMULATION']['file']
+        sim_agents = init_dict['SIMULATION']['agents']
+
+        simulate('test.interalpy.ini', num_procs=1)
+        df, df_counts = process(sim_file + '.interalpy.pkl', sim_agents)
+
+        rslt = dict()
+        for ext in ['txt', 'info']:
+            with open(sim_file + '.interalpy.' + ext, 'r') as infile:
+                rslt[ext] = infile.read()
+
+        simulate('test.interalpy.ini', chunk_size=1, num_procs=np.random.randint(2, 4))
+        df_procs, df_counts_procs = process(sim_file + '.interalpy.npy', sim_agents)
+
+        for ext in ['txt', 'info']:
+            with open(sim_file + '.interalpy.' + ext, 'r') as infile:
+                np.testing.assert_equal(infile.read(), rslt[ext])
+
+        np.testing.assert_equal(df_procs.values, df.values)
+        np.testing.assert_equal(df_counts_procs.values, df_counts.values)
+
+
+def test_6():
+    """This test ensures that the simulated samples in the detailed estimation are only written
+    to disk if requested and that they align with the simulation in memory."""
+    constr = dict()
+    constr['detailed'] = 'True'
+    constr['maxfun'] = 1
+
+    for is_write in [True, False]:
+        get_random_init(constr)
+        simulate('test.interalpy.ini')
+        estimate('test.interalpy.ini', is_write)
+
+        np.testing.assert_equal(os.path.exists('stop/compare.interalpy.info'), True)
+        np.testing.assert_equal(os.path.exists('stop/stop.interalpy.pkl'), is_write)
+
+        if is_write:
+            model_obj = ModelCls('stop/stop.interalpy.ini')
+            np.testing.assert_equal(model_obj.get_attr('sim_file'), 'stop')
+            df_sim = simulate_model(model_obj)
+
+            df_stop = pd.read_pickle('stop/stop.interalpy.pkl')
+            np.testing.assert_equal(df_sim.values, df_stop.values)
+
+
+def test_7():
+    """This test ensures that the simulation of a population with heterogeneous parameters
+    results in the same dataset as the simulation with common parameters if all agents are
+    identical and that each agent faces the solution of the grid for its own parameters."""
+    constr = dict()
+    constr['num_agents'] = np.random.randint(1, 2500)
+
+    for _ in range(3):
+        get_random_init(constr)
+        model_obj = ModelCls('test.interalpy.ini')
+
+        x_econ_all = model_obj.get_attr('paras_obj').get_values('econ', 'all')
+        x_econ_agents = np.tile(x_econ_all, (constr['num_agents'], 1))
+
+        sim_file = model_obj.get_attr('sim_file')
+
+        df_sim = simulate_model(model_obj, is_write=True)
+        with open(sim_file + '.interalpy.info', 'r') as infile:
+            rslt = infile.read()
+
+        df_population = simulate_population(model_obj, x_econ_agents, is_write=True)
+        np.testing.assert_equal(df_population.values, df_sim.values)
+
+        # The information file only lacks the parameterization, which is not shared in general.
+        with open(sim_file + '.interalpy.info', 'r') as infile:
+            np.testing.assert_equal(rslt.startswith(infile.read()), True)
+
+        # We perturb the parameters of a single agent.
+        agent = np.random.randint(constr['num_agents'])
+        x_econ_agents[agent, :] = [np.random.uniform(low, high) for low, high in
+            [(-0.9, 0.9), (-0.9, 0.9), (0.1, 4.9), (0.1, 4.9)]]
+
+        df_population = simulate_population(model_obj, x_econ_agents)
+        df_agent = solve_grid(*x_econ_agents[agent, :]).sort_index()
+        for label in ['eu_a', 'eu_b', 'prob_a', 'prob_b']:
+            stat = df_population[label].loc[agent, :, :].values
+            np.testing.assert_almost_equal(stat, df_agent[label].values)
+
+
+def test_8():
+    """This test ensures that the multistart estimation results in the same local optima
+    regardless of the number of processes and that the best of them is returned."""
+    constr = dict()
+    constr['maxfun'] = np.random.randint(1, 20)
+
+    get_random_init(constr)
+    simulate('test.interalpy.ini')
+
+    num_starts = np.random.randint(1, 10)
+    num_best = np.random.randint(1, num_starts + 1)
+
+    rslts = list()
+    for num_procs in [1, 2]:
+        rslts += [multistart('test.interalpy.ini', num_starts, num_best, num_procs)]
+
+    np.testing.assert_equal(rslts[0][2].values, rslts[1][2].values)
+
+    f_step, x_econ_all_step, df_optima = rslts[0]
+    np.testing.assert_equal(df_optima.shape[0], num_best)
+    np.testing.assert_equal(f_step, df_optima['Criterion'].min())
+    np.testing.assert_equal(os.path.exists('multistart.interalpy.info'), True)
+
+
+def test_9():
+    """This test ensures that an estimation can be resumed from its checkpoint with additional
+    evaluations without losing any progress."""
+    constr = dict()
+    constr['maxfun'] = np.random.randint(2, 10)
+
+    for _ in range(3):
+        get_random_init(constr)
+        simulate('test.interalpy.ini')
+
+        f_step, _ = estimate('test.interalpy.ini')
+        checkpoint = read_checkpoint()
+        num_eval = checkpoint['num_eval']
+
+        np.testing.assert_equal(num_eval <= constr['maxfun'], True)
+        np.testing.assert_equal(checkpoint['f_step'], f_step)
+
+        # We allow for some additional evaluations before resuming the estimation.
+        model_obj = ModelCls('test.interalpy.ini')
+        maxfun = num_eval + np.random.randint(0, 10)
+        model_obj.attr['maxfun'] = maxfun
+        model_obj.write_out('test.interalpy.ini')
+
+        f_resume, _ = estimate('test.interalpy.ini', resume=True)
+        checkpoint = read_checkpoint()
+
+        np.testing.assert_equal(f_resume <= f_step, True)
+        np.testing.assert_equal(num_eval <= checkpoint['num_eval'] <= max(maxfun, num_eval), True)
+        np.testing.assert_equal(checkpoint['f_start'] >= checkpoint['f_step'], True)
+
+        history = read_history()
+        np.testing.assert_equal(history['num_eval'], np.arange(1, checkpoint['num_eval'] + 1))
+        np.testing.assert_equal(history['f_current'].min(), checkpoint['f_step'])
+
+        with open('est.interalpy.log', 'r') as infile:
+            np.testing.assert_equal('ESTIMATION RESUMED' in infile.read(), True)
+
+
+def test_10():
+    """This test ensures that the log of the estimation is rotated if requested in the
+    configuration."""
+    max_bytes = config_interalpy.LOG_MAX_BYTES
+
+    try:
+        config_interalpy.LOG_MAX_BYTES = 1
+        get_random_init()
+        simulate('test.interalpy.ini')
+        estimate('test.interalpy.ini')
+    finally:
+        config_interalpy.LOG_MAX_BYTES = max_bytes
+
+    np.testing.assert_equal(len(glob.glob('est.interalpy.log.*.gz')) > 0, True)
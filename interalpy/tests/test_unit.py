@@ -1,15 +1,66 @@
 """This module contains some unit tests."""
+import pandas as pd
 import numpy as np
+import inspect
+import pytest
+import gzip
+import glob
+import os
+import io
 
 from interalpy.shared.shared_auxiliary import dist_class_attributes
+from interalpy.shared.shared_auxiliary import construct_expected_utilities
 from interalpy.shared.shared_auxiliary import atemporal_utility
 from interalpy.tests.test_auxiliary import get_random_init
+from interalpy.shared.shared_auxiliary import criterion_function_counts
+from interalpy.shared.shared_auxiliary import construct_grid_index
+from interalpy.shared.shared_auxiliary import criterion_function
+from interalpy.shared.shared_auxiliary import criterion_function_batch_compiled
+from interalpy.shared.shared_auxiliary import construct_criterion_counts
+from interalpy.shared.shared_auxiliary import criterion_function_batch
+from interalpy.shared.shared_auxiliary import criterion_gradient_batch
+from interalpy.shared.shared_auxiliary import criterion_gradient_counts
+from interalpy.shared.shared_auxiliary import convert_grid
+from interalpy.shared.shared_auxiliary import solve_grid_arrays
+from interalpy.shared.shared_auxiliary import solve_grid
+from interalpy.shared.shared_auxiliary import read_grid
+from interalpy.shared.shared_auxiliary import get_grid
+from interalpy.shared.shared_auxiliary import luce_log_prob
 from interalpy.shared.shared_auxiliary import luce_prob
 from interalpy.tests.test_auxiliary import get_bounds
 from interalpy.tests.test_auxiliary import get_value
+from interalpy.process.process_auxiliary import construct_counts
+from interalpy.simulate.simulate_auxiliary import construct_simulated
+from interalpy.simulate.simulate_auxiliary import format_integer
+from interalpy.simulate.simulate_auxiliary import sample_choices
+from interalpy.simulate.simulate_auxiliary import format_float
+from interalpy.simulate.simulate_auxiliary import get_widths
+from interalpy.simulate.simulate_auxiliary import write_txt
+from interalpy.estimate.estimate_auxiliary import construct_shares
+from interalpy.estimate.estimate_auxiliary import construct_fit
+from interalpy.estimate.estimate_auxiliary import read_history
+from interalpy.estimate.estimate_auxiliary import get_starts
+from interalpy.estimate.clsEstimate import EstimateClass
 from interalpy.estimate.estimate import estimate
 from interalpy.simulate.simulate import simulate
+from interalpy.config_interalpy import GRID_LABELS
+from interalpy.process.process import process
+from interalpy.config_interalpy import TINY_FLOAT
+from interalpy.config_interalpy import DEFAULT_BOUNDS
+from interalpy.config_interalpy import PARA_LABELS
 from interalpy.config_interalpy import NUM_PARAS
+from interalpy.shared.shared_compiled import atemporal_utility_scalar
+from interalpy.shared.shared_compiled import criterion_kernel
+from interalpy.shared.shared_compiled import softplus_scalar
+from interalpy.shared.shared_compiled import IS_NUMBA
+from interalpy.shared.clsCache import cache_eu_obj
+from interalpy.shared.clsCache import cache_obj
+from interalpy.logging.clsLogger import logger_obj
+from interalpy.logging.clsLogBuffer import LogBufferCls
+from interalpy.custom_exceptions import InteralpyError
+from interalpy.logging.clsHistory import HistoryCls
+from interalpy.shared.clsCache import CacheCls
+from interalpy.paras.clsParas import ParasCls
 from interalpy.clsModel import ModelCls
 from interalpy.read.read import read
 
@@ -90,4 +141,639 @@ def test_6():
         for label in ['r', 'eta', 'b', 'nu']:
             lower, upper = get_bounds(label)
             value = get_value((lower, upper))
-            np.testing.assert_equal(lower < value < upper, True)
\ No newline at end of file
+            np.testing.assert_equal(lower < value < upper, True)
+
+
+def test_7():
+    """This test checks the expected utilities for the whole grid in the special case of linear
+    atemporal utility, where they coincide with the expected total payment."""
+    grid = get_grid()
+    eu_a, eu_b = construct_expected_utilities(grid, 0, 0, 1)
+
+    stat = grid['x'] + grid['y'] + 0.5 * (grid['I1'] + grid['I2'])
+    np.testing.assert_almost_equal(eu_a, stat)
+    np.testing.assert_almost_equal(eu_b, stat + grid['m'])
+
+
+def test_8():
+    """This test ensures that the grid of choices is only read once, cannot be modified, and that
+    a grid in the legacy pickle format is converted properly."""
+    grid = get_grid()
+    np.testing.assert_equal(get_grid() is grid, True)
+
+    for label in GRID_LABELS:
+        np.testing.assert_equal(grid[label].flags.writeable, False)
+
+    pd.DataFrame(grid).to_pickle('grid.interalpy.pkl')
+    convert_grid('grid.interalpy.pkl', 'grid.interalpy.npz')
+
+    for fname in ['grid.interalpy.pkl', 'grid.interalpy.npz']:
+        stat = read_grid(fname)
+        for label in GRID_LABELS:
+            np.testing.assert_equal(stat[label], grid[label])
+            np.testing.assert_equal(stat[label].dtype, grid[label].dtype)
+
+
+def test_9():
+    """This test ensures that the criterion function based on the number of choices in each cell
+    of the grid is the same as the average over all individual observations."""
+    get_random_init()
+
+    model_obj = ModelCls('test.interalpy.ini')
+    paras_obj = dist_class_attributes(model_obj, 'paras_obj')
+    r, eta, b, nu = paras_obj.get_values('econ', 'all')
+
+    grid = solve_grid(r, eta, b, nu).reset_index(drop=True)
+
+    num_agents = np.random.randint(1, 10)
+    df = pd.concat([grid] * num_agents, ignore_index=True)
+    df['D'] = np.random.choice([0, 1], size=df.shape[0])
+    df['grid_idx'] = construct_grid_index(df)
+
+    df_counts = construct_counts(df)
+    np.testing.assert_equal(df_counts[['n_A', 'n_B']].values.sum(), df.shape[0])
+
+    prob = df['D'] * df['prob_a'] + (1 - df['D']) * df['prob_b']
+    stat = -np.mean(np.log(np.clip(prob, TINY_FLOAT, np.inf)))
+    np.testing.assert_almost_equal(criterion_function_counts(df_counts, r, eta, b, nu), stat)
+    np.testing.assert_almost_equal(criterion_function(df, r, eta, b, nu), stat)
+
+
+def test_10():
+    """This test ensures that the choice probabilities are accurate for large utilities and small
+    values of nu, where the utilities raised to the power of 1 / nu cannot be represented."""
+    for _ in range(100):
+        u_x, u_y = np.random.uniform(10e+5, 10e+10, size=2)
+        nu = np.random.uniform(0.01, 0.02)
+
+        log_prob_x, log_prob_y = luce_log_prob(u_x, u_y, nu)
+
+        stat = (np.log(u_y) - np.log(u_x)) / nu
+        np.testing.assert_almost_equal(log_prob_x - log_prob_y, -stat)
+        np.testing.assert_almost_equal(np.exp(log_prob_x) + np.exp(log_prob_y), 1.0)
+
+
+def test_11():
+    """This test compares the analytic gradient of the criterion function with respect to the free
+    parameters of the optimizer against its finite-difference approximation."""
+    for _ in range(5):
+        get_random_init()
+        simulate('test.interalpy.ini')
+
+        model_obj = ModelCls('test.interalpy.ini')
+        paras_obj, est_file, est_agents = dist_class_attributes(model_obj, 'paras_obj',
+            'est_file', 'est_agents')
+
+        df, df_counts = process(est_file, est_agents)
+        estimate_obj = EstimateClass(df, df_counts, paras_obj, 0)
+
+        x_optim_free = np.array(paras_obj.get_values('optim', 'free'))
+
+        grad = estimate_obj.gradient(x_optim_free)
+
+        stat = list()
+        for i in range(x_optim_free.shape[0]):
+            step = np.zeros(x_optim_free.shape[0])
+            step[i] = 10e-7
+            upper = estimate_obj.evaluate(x_optim_free + step)
+            lower = estimate_obj.evaluate(x_optim_free - step)
+            stat += [(upper - lower) / (2 * step[i])]
+
+        np.testing.assert_allclose(grad, stat, rtol=10e-5, atol=10e-8)
+
+
+def test_12():
+    """This test compares the Hessian of the criterion function against the second differences of
+    the criterion function and ensures that the standard errors are reported."""
+    for _ in range(5):
+        get_random_init()
+        simulate('test.interalpy.ini')
+
+        model_obj = ModelCls('test.interalpy.ini')
+        paras_obj, est_file, est_agents = dist_class_attributes(model_obj, 'paras_obj',
+            'est_file', 'est_agents')
+
+        df, df_counts = process(est_file, est_agents)
+        estimate_obj = EstimateClass(df, df_counts, paras_obj, 0)
+
+        x_optim_free = np.array(paras_obj.get_values('optim', 'free'))
+
+        hess = estimate_obj.hessian(x_optim_free)
+
+        fval = estimate_obj.evaluate(x_optim_free)
+        for i in range(x_optim_free.shape[0]):
+            step = np.zeros(x_optim_free.shape[0])
+            step[i] = 10e-5
+            upper = estimate_obj.evaluate(x_optim_free + step)
+            lower = estimate_obj.evaluate(x_optim_free - step)
+            stat = (upper - 2 * fval + lower) / step[i] ** 2
+            np.testing.assert_allclose(hess[i, i], stat, rtol=10e-3, atol=10e-6)
+
+        se_econ_all, _ = estimate_obj.inference(x_optim_free)
+        for i, label in enumerate(PARA_LABELS):
+            if paras_obj.get_para(label)[1]:
+                np.testing.assert_equal(np.isinf(se_econ_all[i]), True)
+
+
+def test_13():
+    """This test ensures that the evaluation of the criterion function for a batch of parameter
+    vectors is the same as evaluating them one after another."""
+    get_random_init()
+    simulate('test.interalpy.ini')
+
+    model_obj = ModelCls('test.interalpy.ini')
+    est_file, est_agents = dist_class_attributes(model_obj, 'est_file', 'est_agents')
+    _, df_counts = process(est_file, est_agents)
+
+    num_points = np.random.randint(1, 100)
+
+    x_econ_all = list()
+    for label in PARA_LABELS:
+        x_econ_all += [np.random.uniform(*DEFAULT_BOUNDS[label], size=num_points)]
+    x_econ_all = np.column_stack(x_econ_all)
+
+    fvals = criterion_function_batch(df_counts, x_econ_all)
+    for i in range(num_points):
+        stat = criterion_function_counts(df_counts, *x_econ_all[i, :])
+        np.testing.assert_almost_equal(fvals[i], stat)
+
+
+def test_14():
+    """This test checks the bounded cache of the grid solutions."""
+    cache_small = CacheCls(2)
+
+    for key in ['a', 'b', 'a', 'c']:
+        if cache_small.get_entry(key) is None:
+            cache_small.set_entry(key, key)
+
+    # The least recently used entry is discarded first.
+    np.testing.assert_equal(list(cache_small.get_attr('entries').keys()), ['a', 'c'])
+    np.testing.assert_equal(cache_small.get_attr('hits'), 1)
+    np.testing.assert_equal(cache_small.get_attr('misses'), 3)
+
+    cache_small.set_max_size(1)
+    np.testing.assert_equal(list(cache_small.get_attr('entries').keys()), ['c'])
+
+    # Repeated solutions of the grid are served from the cache and cannot be modified.
+    x_econ_all = [np.random.uniform(*DEFAULT_BOUNDS[label]) for label in PARA_LABELS]
+    solution = solve_grid_arrays(*x_econ_all)
+    np.testing.assert_equal(solve_grid_arrays(*x_econ_all) is solution, True)
+    np.testing.assert_equal(solution['prob_a'].flags.writeable, False)
+
+
+def test_15():
+    """This test ensures that the expected utilities are reused if only nu changes."""
+    r, eta, b, nu = [np.random.uniform(*DEFAULT_BOUNDS[label]) for label in PARA_LABELS]
+
+    solution = solve_grid_arrays(r, eta, b, nu)
+
+    hits = cache_eu_obj.get_attr('hits')
+    stat = solve_grid_arrays(r, eta, b, nu / 2)
+    np.testing.assert_equal(cache_eu_obj.get_attr('hits'), hits + 1)
+
+    np.testing.assert_equal(stat['eu_a'] is solution['eu_a'], True)
+    np.testing.assert_equal(np.all(stat['prob_a'] == solution['prob_a']), False)
+
+    cache_obj.clear()
+    cache_eu_obj.clear()
+    np.testing.assert_equal(solve_grid_arrays(r, eta, b, nu / 2)['prob_a'], stat['prob_a'])
+
+
+@pytest.mark.skipif(not IS_NUMBA, reason='numba not available')
+def test_16():
+    """This test ensures that the compiled kernel for the criterion function yields the same
+    results as the NumPy engine."""
+    get_random_init()
+    simulate('test.interalpy.ini')
+
+    model_obj = ModelCls('test.interalpy.ini')
+    est_file, est_agents = dist_class_attributes(model_obj, 'est_file', 'est_agents')
+    _, df_counts = process(est_file, est_agents)
+
+    num_points = np.random.randint(1, 100)
+
+    x_econ_all = list()
+    for label in PARA_LABELS:
+        x_econ_all += [np.random.uniform(*DEFAULT_BOUNDS[label], size=num_points)]
+    x_econ_all = np.column_stack(x_econ_all)
+
+    r, eta, b, nu = [x_econ_all[:, [i]] for i in range(NUM_PARAS)]
+    stat = construct_criterion_counts(df_counts, solve_grid_arrays(r, eta, b, nu))
+
+    fvals = criterion_function_batch_compiled(df_counts, x_econ_all)
+    np.testing.assert_allclose(fvals, stat, rtol=10e-10)
+
+    # The compilation leaves the functions in pure Python untouched.
+    for func in [atemporal_utility_scalar, softplus_scalar, criterion_kernel]:
+        np.testing.assert_equal(inspect.isfunction(func), True)
+
+
+def test_17():
+    """This test ensures that the package does not change the global floating-point policy and
+    that overflows in the transformation of the parameters are counted."""
+    np.testing.assert_equal(np.geterr()['over'] != 'raise', True)
+
+    # We need to start with a clean record of all events.
+    with open('test.interalpy.log', 'w') as outfile:
+        logger_obj.flush(outfile)
+
+    values = np.random.uniform(-10e+5, -10e+3, size=np.random.randint(1, 10))
+    lower, upper = get_bounds('b')
+    stat = ParasCls._to_interval(values, lower, upper)
+
+    np.testing.assert_equal(np.all(np.isfinite(stat)), True)
+    np.testing.assert_almost_equal(stat, lower)
+    np.testing.assert_equal(logger_obj.get_attr('errors')[2], values.shape[0])
+
+
+def test_18():
+    """This test ensures that sampling the choices of all agents at once results in the same
+    choices as sampling each of them one after another for the same seed."""
+    num_agents, num_cells = np.random.randint(1, 10, size=2)
+    prob_a = np.random.uniform(size=num_cells)
+    prob_b = 1 - prob_a
+
+    seed = np.random.randint(1, 1000)
+
+    np.random.seed(seed)
+    stat = list()
+    for _ in range(num_agents):
+        for i in range(num_cells):
+            stat += [np.random.choice([1, 0], p=[prob_a[i], prob_b[i]])]
+
+    np.random.seed(seed)
+    choices = sample_choices(prob_a, prob_b, num_agents)
+
+    np.testing.assert_equal(choices.reshape(-1), stat)
+
+
+def test_19():
+    """This test ensures that the fast writer for the human-readable dataset results in the very
+    same output as the pretty printing of pandas and that the output can be skipped."""
+    init_dict = get_random_init()
+    sim_file = init_dict['SIMULATION']['file']
+
+    grid = solve_grid(*[get_value(get_bounds(label)) for label in PARA_LABELS])
+    choices = np.random.randint(0, 2, size=(np.random.randint(1, 10), grid.shape[0]))
+
+    df = construct_simulated(grid, choices, np.random.randint(0, 100000))
+    for _ in range(5):
+        i, j = np.random.randint(df.shape[0]), np.random.choice([2, 4, 5, 6, 7])
+        df.iat[i, j] = np.random.choice([np.nan, -0.0, 10e8 * np.random.normal()])
+
+    formats = []
+    formats += [format_integer, format_integer, format_float, format_integer, format_float]
+    formats += [format_float, format_float, format_float]
+    rslt = df.to_string(index=False, header=True, na_rep='.', formatters=formats)
+
+    for is_header in [True, False]:
+        outfile = io.StringIO()
+        write_txt(df, outfile, is_header, np.random.randint(1, 100))
+
+        stat = outfile.getvalue()
+        if not is_header:
+            stat = rslt.split('\n', 1)[0] + stat
+        np.testing.assert_equal(stat, rslt)
+
+    if os.path.exists(sim_file + '.interalpy.txt'):
+        os.remove(sim_file + '.interalpy.txt')
+
+    simulate('test.interalpy.ini', chunk_size=np.random.choice([None, 1]), is_text=False)
+    np.testing.assert_equal(os.path.exists(sim_file + '.interalpy.txt'), False)
+
+
+def test_20():
+    """This test ensures that the choice shares from the grouped aggregation align with the shares
+    computed one cell of the grid after another."""
+    init_dict = get_random_init()
+    sim_file = init_dict['SIMULATION']['file']
+
+    simulate('test.interalpy.ini')
+    df, _ = process(sim_file + '.interalpy.pkl', init_dict['ESTIMATION']['agents'])
+
+    shares = construct_shares(df)
+    for (question, m), stat in shares.items():
+        np.testing.assert_almost_equal(stat, df['D'].loc[:, question, m].mean())
+
+
+def test_21():
+    """This test ensures that the contributions of the cells of the grid in the fit diagnostic
+    add up to the criterion function and that the observed shares align with the dataset."""
+    init_dict = get_random_init()
+    sim_file = init_dict['SIMULATION']['file']
+
+    simulate('test.interalpy.ini')
+    df, df_counts = process(sim_file + '.interalpy.pkl', init_dict['ESTIMATION']['agents'])
+
+    x_econ_all = [get_value(get_bounds(label)) for label in PARA_LABELS]
+    stats = construct_fit(df_counts, x_econ_all)
+
+    stat = criterion_function_counts(df_counts, *x_econ_all)
+    np.testing.assert_almost_equal(stats['Contribution'].sum(), stat)
+
+    shares = construct_shares(df)
+    np.testing.assert_almost_equal(stats['Data'].values, shares.values)
+    np.testing.assert_equal(stats['Observations'].sum(), df.shape[0])
+
+
+def test_22():
+    """This test ensures that the starting points of the multistart estimation cover each stratum
+    of the bounds of the free parameters exactly once."""
+    get_random_init()
+    paras_obj = ModelCls('test.interalpy.ini').get_attr('paras_obj')
+
+    num_starts = np.random.randint(2, 100)
+    starts = get_starts(paras_obj, num_starts, np.random.randint(1, 1000))
+
+    np.testing.assert_equal(starts[0, :], paras_obj.get_values('econ', 'all'))
+    for i, label in enumerate(PARA_LABELS):
+        value, is_fixed, (lower, upper) = paras_obj.get_para(label)
+        if is_fixed:
+            np.testing.assert_equal(np.all(starts[:, i] == value), True)
+        else:
+            strata = np.floor((starts[1:, i] - lower) / (upper - lower) * (num_starts - 1))
+            np.testing.assert_equal(np.sort(strata), np.arange(num_starts - 1))
+
+
+def test_23():
+    """This test ensures that the batched finite-difference gradient aligns with the forward
+    differences of single evaluations and keeps track of the number of evaluations."""
+    for _ in range(5):
+        get_random_init()
+        simulate('test.interalpy.ini')
+
+        model_obj = ModelCls('test.interalpy.ini')
+        paras_obj, est_file, est_agents = dist_class_attributes(model_obj, 'paras_obj',
+            'est_file', 'est_agents')
+
+        df, df_counts = process(est_file, est_agents)
+        estimate_obj = EstimateClass(df, df_counts, paras_obj, 0)
+
+        x_optim_free = np.array(paras_obj.get_values('optim', 'free'))
+        num_free, eps = x_optim_free.shape[0], 10e-7
+
+        # The criterion function is evaluated at the current point only if it is not the most
+        # recent evaluation. Either way, there is one evaluation for each point of the stencil.
+        is_current = np.random.choice([True, False])
+        if is_current:
+            center = estimate_obj.evaluate(x_optim_free)
+
+        grad = estimate_obj.gradient_numerical(x_optim_free, eps)
+
+        np.testing.assert_almost_equal(paras_obj.get_values('optim', 'free'), x_optim_free)
+        np.testing.assert_equal(estimate_obj.get_attr('num_eval'), num_free + 1)
+
+        if not is_current:
+            center = estimate_obj.evaluate(x_optim_free)
+
+        stat = list()
+        for i in range(num_free):
+            step = np.zeros(num_free)
+            step[i] = eps
+            stat += [(estimate_obj.evaluate(x_optim_free + step) - center) / eps]
+
+        np.testing.assert_allclose(grad, stat, rtol=10e-5, atol=10e-8)
+
+
+def test_24():
+    """This test ensures that the buffered logging writes all entries in the right order and that
+    the rotated logs are compressed without any loss of information."""
+    for fname in glob.glob('test.interalpy.log*'):
+        os.remove(fname)
+
+    flush_evals, max_bytes = np.random.randint(1, 10), np.random.choice([None, 100])
+    log_obj = LogBufferCls('test.interalpy.log', flush_evals, 10e6, max_bytes)
+
+    entries = ['\n Entry {:>5}'.format(i) for i in range(np.random.randint(1, 50))]
+    for i, entry in enumerate(entries):
+        is_due = log_obj.add_entry(entry)
+        np.testing.assert_equal(is_due, (i + 1) % flush_evals == 0)
+        if is_due:
+            log_obj.flush()
+    log_obj.flush()
+
+    stat = ''
+    for fname in sorted(glob.glob('test.interalpy.log.*.gz'), key=lambda x: int(x.split('.')[3])):
+        with gzip.open(fname, 'rt') as infile:
+            stat += infile.read()
+
+    with open('test.interalpy.log', 'r') as infile:
+        stat += infile.read()
+
+    np.testing.assert_equal(stat, ''.join(entries))
+
+
+def test_25():
+    """This test ensures that the binary history records all evaluations, even beyond its initial
+    size, and that it can be read during the estimation."""
+    get_random_init()
+    simulate('test.interalpy.ini')
+
+    model_obj = ModelCls('test.interalpy.ini')
+    paras_obj, est_file, est_agents = dist_class_attributes(model_obj, 'paras_obj', 'est_file',
+        'est_agents')
+
+    df, df_counts = process(est_file, est_agents)
+    # We only allocate a single row initially and never reach the maximum number of evaluations.
+    estimate_obj = EstimateClass(df, df_counts, paras_obj, np.random.randint(0, 2))
+
+    x_optim_free = np.array(paras_obj.get_values('optim', 'free'))
+
+    fvals, x_econ_all = list(), list()
+    for _ in range(np.random.randint(1, 20)):
+        x_optim_free_eval = x_optim_free + np.random.normal(size=x_optim_free.shape[0])
+        fvals += [estimate_obj.evaluate(x_optim_free_eval)]
+        x_econ_all += [estimate_obj.get_attr('x_econ_all_current')]
+
+        history = read_history()
+        np.testing.assert_equal(history['num_eval'], np.arange(1, len(fvals) + 1))
+        np.testing.assert_equal(history['f_current'], fvals)
+        np.testing.assert_equal(history['x_econ_all'], x_econ_all)
+        np.testing.assert_equal(np.all(np.diff(history['time']) >= 0), True)
+
+
+def test_26():
+    """This test compares the derivatives of the mapping from the parameters of the optimizer to
+    the economic parameters against their finite-difference approximation and ensures that no
+    events are recorded, even when the economic parameters are close to their bounds."""
+    for _ in range(5):
+        get_random_init()
+
+        paras_obj = ModelCls('test.interalpy.ini').get_attr('paras_obj')
+
+        x_optim_free = np.random.normal(scale=10, size=len(paras_obj.get_values('optim', 'free')))
+        paras_obj.set_values('optim', 'free', x_optim_free)
+
+        logger_obj.flush(io.StringIO())
+        jacobian = paras_obj.get_jacobian(x_optim_free)
+        np.testing.assert_equal(logger_obj.get_attr('errors'), dict())
+
+        stat = list()
+        for i in range(x_optim_free.shape[0]):
+            step = np.zeros(x_optim_free.shape[0])
+            step[i] = 10e-7
+            paras_obj.set_values('optim', 'free', x_optim_free + step)
+            upper = np.array(paras_obj.get_values('econ', 'free'))
+            paras_obj.set_values('optim', 'free', x_optim_free - step)
+            lower = np.array(paras_obj.get_values('econ', 'free'))
+            stat += [(upper - lower)[i] / (2 * step[i])]
+
+        np.testing.assert_allclose(jacobian, stat, rtol=10e-5, atol=10e-8)
+
+
+def test_27():
+    """This test ensures that the events during the solution of the grid are recorded no matter
+    whether the solution or the expected utilities are served from the cache."""
+    r, eta, b, nu = 1.0, 1.0, np.random.uniform(*DEFAULT_BOUNDS['b']), np.random.uniform(0.1, 5)
+
+    cache_obj.clear()
+    cache_eu_obj.clear()
+
+    stats = list()
+    for nu_eval in [nu, nu, nu / 2]:
+        logger_obj.flush(io.StringIO())
+        solve_grid_arrays(r, eta, b, nu_eval)
+        stats += [logger_obj.get_attr('errors')]
+
+    np.testing.assert_equal(cache_obj.get_attr('hits'), 1)
+    np.testing.assert_equal(cache_eu_obj.get_attr('hits'), 1)
+
+    np.testing.assert_equal(stats[0][0] > 0, True)
+    for stat in stats[1:]:
+        np.testing.assert_equal(stat, stats[0])
+
+
+def test_28():
+    """This test ensures that the human-readable dataset is the same whether it is written at
+    once or chunk by chunk with the widths of the columns for all agents."""
+    grid = solve_grid(*[get_value(get_bounds(label)) for label in PARA_LABELS])
+
+    num_agents = np.random.randint(1, 100)
+    choices = np.random.randint(0, 2, size=(num_agents, grid.shape[0]))
+
+    outfile = io.StringIO()
+    write_txt(construct_simulated(grid, choices), outfile)
+    rslt = outfile.getvalue()
+
+    widths = get_widths(grid, num_agents)
+    chunk_size = np.random.randint(1, num_agents + 1)
+
+    outfile = io.StringIO()
+    for start in range(0, num_agents, chunk_size):
+        df_chunk = construct_simulated(grid, choices[start:start + chunk_size], start)
+        write_txt(df_chunk, outfile, is_header=(start == 0), widths=widths)
+
+    np.testing.assert_equal(outfile.getvalue(), rslt)
+
+
+def test_29():
+    """This test ensures that the binary history grows in place, so that it remains readable
+    through an earlier mapping, and that only a compatible history is resumed."""
+    history_obj = HistoryCls('test.interalpy.npy', 1)
+    x_econ_all = np.random.uniform(size=NUM_PARAS)
+
+    history_obj.append(1, 0.0, x_econ_all, x_econ_all, dict())
+    history_obj.flush()
+
+    records = np.load('test.interalpy.npy', mmap_mode='r')
+    inode = os.stat('test.interalpy.npy').st_ino
+
+    num_evals = np.random.randint(2, 100)
+    for num_eval in range(2, num_evals + 1):
+        history_obj.append(num_eval, float(num_eval), x_econ_all, x_econ_all, {0: num_eval})
+    history_obj.flush()
+
+    np.testing.assert_equal(os.stat('test.interalpy.npy').st_ino, inode)
+    np.testing.assert_equal(records['num_eval'][0], 1)
+
+    history = read_history('test.interalpy.npy')
+    np.testing.assert_equal(history['num_eval'], np.arange(1, num_evals + 1))
+    np.testing.assert_equal(history['warnings'][1:, 0], np.arange(2, num_evals + 1))
+
+    history_obj = HistoryCls('test.interalpy.npy', 1, is_resume=True)
+    np.testing.assert_equal(history_obj.get_attr('records').shape[0] >= num_evals, True)
+
+    np.save('test.interalpy.npy', np.zeros(num_evals))
+    with pytest.raises(InteralpyError):
+        HistoryCls('test.interalpy.npy', 1, is_resume=True)
+
+
+def test_30():
+    """This test ensures that the evaluation of the analytic gradient of the criterion function
+    for a batch of parameter vectors is the same as evaluating them one after another."""
+    get_random_init()
+    simulate('test.interalpy.ini')
+
+    model_obj = ModelCls('test.interalpy.ini')
+    est_file, est_agents = dist_class_attributes(model_obj, 'est_file', 'est_agents')
+    _, df_counts = process(est_file, est_agents)
+
+    num_points = np.random.randint(1, 10)
+    x_econ_all = np.zeros((num_points, NUM_PARAS))
+    for i, label in enumerate(PARA_LABELS):
+        x_econ_all[:, i] = np.random.uniform(*DEFAULT_BOUNDS[label], size=num_points)
+
+    grads = criterion_gradient_batch(df_counts, x_econ_all)
+    for i in range(num_points):
+        stat = criterion_gradient_counts(df_counts, *x_econ_all[i, :])
+        np.testing.assert_almost_equal(grads[i, :], stat)
+
+
+def test_31():
+    """This test ensures that the events during the evaluation of the gradient of the criterion
+    function are not charged to the subsequent evaluation."""
+    get_random_init()
+    simulate('test.interalpy.ini')
+
+    model_obj = ModelCls('test.interalpy.ini')
+    paras_obj, est_file, est_agents = dist_class_attributes(model_obj, 'paras_obj', 'est_file',
+        'est_agents')
+
+    df, df_counts = process(est_file, est_agents)
+    estimate_obj = EstimateClass(df, df_counts, paras_obj, 0)
+
+    x_optim_free = np.array(paras_obj.get_values('optim', 'free'))
+    x_optim_free_overflow = x_optim_free.copy()
+    x_optim_free_overflow[0] = -800
+
+    logger_obj.flush(io.StringIO())
+    estimate_obj.evaluate(x_optim_free)
+    estimate_obj.evaluate(x_optim_free_overflow)
+    estimate_obj.gradient(x_optim_free_overflow)
+    estimate_obj.hessian(x_optim_free_overflow)
+    estimate_obj.evaluate(x_optim_free)
+
+    history = read_history()
+    np.testing.assert_equal(history['warnings'][1, 2] > 0, True)
+    np.testing.assert_equal(history['warnings'][2], history['warnings'][0])
+
+
+def test_32():
+    """This test ensures that the events at each point of the stencil of the numerical gradient
+    are recorded with the evaluation at that point."""
+    get_random_init()
+    simulate('test.interalpy.ini')
+
+    model_obj = ModelCls('test.interalpy.ini')
+    paras_obj, est_file, est_agents = dist_class_attributes(model_obj, 'paras_obj', 'est_file',
+        'est_agents')
+
+    df, df_counts = process(est_file, est_agents)
+
+    x_optim_free = np.array(paras_obj.get_values('optim', 'free'))
+    x_optim_free[0] = np.random.choice([-800, x_optim_free[0]])
+    eps = np.random.uniform(10e-8, 10e-4)
+
+    logger_obj.flush(io.StringIO())
+    estimate_obj = EstimateClass(df, df_counts, paras_obj, 0)
+    estimate_obj.gradient_numerical(x_optim_free, eps)
+    rslt = read_history()['warnings']
+
+    stencil = np.tile(x_optim_free, (x_optim_free.shape[0] + 1, 1))
+    stencil[1:, :] += np.identity(x_optim_free.shape[0]) * eps
+
+    estimate_obj = EstimateClass(df, df_counts, paras_obj, 0)
+    for x_optim_free_eval in stencil:
+        estimate_obj.evaluate(x_optim_free_eval)
+
+    np.testing.assert_equal(rslt, read_history()['warnings'])
@@ -117,7 +117,7 @@ setup(
     #
     # For an analysis of "install_requires" vs pip's requirements files see:
     # https://packaging.python.org/en/latest/requirements.html
-    install_requires=['statsmodels==0.8', 'scipy==1.0', 'numpy==1.13', 'pandas==0.21'],  # Optional
+    install_requires=['statsmodels==0.8', 'scipy==1.0', 'numpy==1.17', 'pandas==0.21'],  # Optional
 
     # List additional groups of dependencies here (e.g. development
     # dependencies). Users will be able to install these using the "extras"
@@ -130,6 +130,7 @@ setup(
     extras_require={  # Optional
         'dev': ['check-manifest'],
         'test': ['pytest'],
+        'numba': ['numba'],
     },
 
     # If there are data files included in your packages that need to be
@@ -138,7 +139,7 @@ setup(
     # If using Python 2.6 or earlier, then these have to be included in
     # MANIFEST.in as well.
     package_data={  # Optional
-        'material': ['grid.interalpy.pkl'],
+        'material': ['grid.interalpy.npz'],
     },
 
     # Although 'package_data' is the preferred approach, in some case you may